@@ -0,0 +1,63 @@
+import os
+from threading import Lock
+from typing import Dict, Iterable, Tuple
+
+from pakRegistry import getPathKey
+
+class ArtifactStore:
+    """
+    Contents of the artifacts (pak, mrb) built during the current rebuild. Every artifact
+    is read once after it has been written, the following steps (hashing, dat export)
+    use the buffer instead of reading the file again.
+    A buffer is only used as long as its file hasn't been touched since.
+    """
+    # path key -> ((mtime, size), content)
+    entries: Dict[str, Tuple[Tuple[int, int], bytes]]
+
+    def __init__(self):
+        self.entries = {}
+        # build steps run in parallel
+        self.lock = Lock()
+
+    def read(self, file: str, keep: bool = True) -> bytes:
+        """Reads a freshly written artifact and keeps its content, if keep is set."""
+        with open(file, "rb") as f:
+            data = f.read()
+            stat = os.fstat(f.fileno())
+        if keep:
+            self.keep(file, stat, data)
+        return data
+
+    def add(self, file: str, data: bytes) -> None:
+        """Keeps the content of an artifact that has just been written from memory."""
+        self.keep(file, os.stat(file), data)
+
+    def keep(self, file: str, stat: os.stat_result, data: bytes) -> None:
+        with self.lock:
+            self.entries[getPathKey(file)] = ((stat.st_mtime_ns, stat.st_size), data)
+
+    def get(self, file: str) -> bytes:
+        # None if the file isn't stored or has changed since
+        with self.lock:
+            entry = self.entries.get(getPathKey(file))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return None
+        if entry[0] != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return entry[1]
+
+    def getAll(self, files: Iterable[str]) -> Dict[str, bytes]:
+        buffers = {}
+        for file in files:
+            data = self.get(file)
+            if data is not None:
+                buffers[file] = data
+        return buffers
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
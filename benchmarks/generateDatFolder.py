@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+from typing import List, Tuple
+
+# also runs as a script, the repo root has to be importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nier2blender2nier.hashing import ACTION_CODE, ENTITY_CODE, crc32
+
+HASHED_NAMES = ["Wait", "Move", "Attack", "Talk", "Fade", "Spawn", "Trigger", "Sound"]
+
+class GeneratedFolder:
+    """What generateDatFolder created, used to compute throughput"""
+    folder: str
+    xmlFiles: List[str]
+    memberFiles: List[str]
+    xmlBytes: int
+    memberBytes: int
+    elementCount: int
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.xmlFiles = []
+        self.memberFiles = []
+        self.xmlBytes = 0
+        self.memberBytes = 0
+        self.elementCount = 0
+
+class XmlWriter:
+    def __init__(self):
+        self.parts: List[str] = []
+        self.elementCount = 0
+
+    def open(self, tag: str, attributes: str = "") -> None:
+        self.parts.append(f"<{tag}{attributes}>")
+        self.elementCount += 1
+
+    def close(self, tag: str) -> None:
+        self.parts.append(f"</{tag}>")
+
+    def leaf(self, tag: str, text: str, attributes: str = "") -> None:
+        self.parts.append(f"<{tag}{attributes}>{text}</{tag}>")
+        self.elementCount += 1
+
+    def getvalue(self) -> str:
+        return "\n".join(self.parts)
+
+def writeFileOrderMetadata(path: str, names: List[str]) -> None:
+    nameLength = max(len(name) for name in names) + 1
+    with open(path, "wb") as f:
+        f.write(struct.pack("<II", len(names), nameLength))
+        for name in names:
+            f.write(name.encode("utf-8").ljust(nameLength, b"\x00"))
+
+def splitIds(ids: List[int]) -> Tuple[List[int], List[int], List[int]]:
+    # id definitions of a file, split between actions, entities and script variables
+    return ids[0::3], ids[1::3], ids[2::3]
+
+def pickReference(rng: random.Random, ids: List[int]) -> int:
+    # about 1% of references point to ids that don't exist
+    if rng.random() < 0.01:
+        return rng.randint(0x80000000, 0xFFFFFFFF)
+    return rng.choice(ids)
+
+def generatePakXml(
+    rng: random.Random, fileId: int, ownIds: List[int], allActionIds: List[int], allEntityIds: List[int],
+    elementCount: int, referenceCount: int, groupCount: int, defineGroups: bool, referenceGroup: bool
+) -> XmlWriter:
+    xml = XmlWriter()
+    xml.open("root")
+    xml.leaf("id", f"0x{fileId:x}")
+    if defineGroups:
+        for groupId in range(1, groupCount + 1):
+            xml.open("group")
+            xml.leaf("id", f"0x{groupId:x}")
+            xml.close("group")
+    elif referenceGroup:
+        xml.leaf("group", f"0x{rng.randint(1, groupCount):x}")
+
+    actionIds, entityIds, variableIds = splitIds(ownIds)
+    for actionId in actionIds:
+        xml.open("action")
+        xml.leaf("id", f"0x{actionId:x}")
+        xml.leaf("code", f"0x{crc32(ACTION_CODE):x}", f' str="{ACTION_CODE}"')
+        xml.close("action")
+    xml.open("layouts")
+    xml.open("normal")
+    xml.open("layouts")
+    for entityId in entityIds:
+        xml.open("value")
+        xml.leaf("id", f"0x{entityId:x}")
+        xml.close("value")
+    xml.close("layouts")
+    xml.close("normal")
+    xml.close("layouts")
+    xml.open("variables")
+    for variableId in variableIds:
+        xml.open("value")
+        xml.leaf("id", f"0x{variableId:x}")
+        xml.close("value")
+    xml.close("variables")
+
+    # references to ids of any file
+    xml.open("references")
+    for _ in range(referenceCount):
+        xml.open("ref")
+        if rng.random() < 0.5:
+            xml.leaf("code", f"0x{crc32(ACTION_CODE):x}", f' str="{ACTION_CODE}"')
+            xml.leaf("value", f"0x{pickReference(rng, allActionIds):x}")
+        else:
+            xml.leaf("code", f"0x{crc32(ENTITY_CODE):x}")
+            xml.leaf("id", f"0x{pickReference(rng, allEntityIds):x}")
+        xml.close("ref")
+    xml.close("references")
+
+    # filler elements with sizes and hashed names
+    xml.open("nodes")
+    while xml.elementCount < elementCount:
+        childCount = rng.randint(1, 4)
+        xml.open("node")
+        xml.leaf("size", str(childCount))
+        for _ in range(childCount):
+            name = rng.choice(HASHED_NAMES)
+            xml.leaf("name", f"0x{crc32(name):x}", f' str="{name}"')
+        xml.close("node")
+    xml.close("nodes")
+    xml.close("root")
+    return xml
+
+def generateDatFolder(
+    folder: str,
+    paks: int = 20,
+    xmlsPerPak: int = 10,
+    elementsPerXml: int = 500,
+    idsPerXml: int = 30,
+    referencesPerXml: int = 30,
+    extraMembers: int = 100,
+    memberSize: int = 64 * 1024,
+    metadata: str = "json",
+    seed: int = 1,
+) -> GeneratedFolder:
+    """
+    Creates a dat folder with extracted paks (xml files and pakInfo.json), pak files,
+    additional member files and dat_info.json or file_order.metadata.
+    """
+    rng = random.Random(seed)
+    generated = GeneratedFolder(folder)
+    os.makedirs(folder, exist_ok=True)
+
+    xmlCount = paks * xmlsPerPak
+    allIds = rng.sample(range(1, 0x80000000), xmlCount * (idsPerXml + 1))
+    fileIds = allIds[:xmlCount]
+    definedIds = [allIds[xmlCount + i * idsPerXml:xmlCount + (i + 1) * idsPerXml] for i in range(xmlCount)]
+    allActionIds = []
+    allEntityIds = []
+    for ownIds in definedIds:
+        actionIds, entityIds, _ = splitIds(ownIds)
+        allActionIds.extend(actionIds)
+        allEntityIds.extend(entityIds)
+    allActionIds = allActionIds or [0]
+    allEntityIds = allEntityIds or [0]
+
+    memberNames = []
+    for pakIndex in range(paks):
+        pakName = f"p{pakIndex:03d}.pak"
+        pakDir = os.path.join(folder, "nier2blender_extracted", pakName)
+        os.makedirs(pakDir, exist_ok=True)
+        pakFiles = []
+        for xmlIndex in range(xmlsPerPak):
+            fileIndex = pakIndex * xmlsPerPak + xmlIndex
+            xmlName = f"{xmlIndex}.xml"
+            # the groups are defined once, in the 0.xml of the first pak,
+            # other 0.xml files can't reference one, since <group> would count as a definition
+            defineGroups = fileIndex == 0
+            referenceGroup = xmlName != "0.xml"
+            xml = generatePakXml(
+                rng, fileIds[fileIndex], definedIds[fileIndex], allActionIds, allEntityIds,
+                elementsPerXml, referencesPerXml, 4, defineGroups, referenceGroup
+            )
+            xmlPath = os.path.join(pakDir, xmlName)
+            with open(xmlPath, "w") as f:
+                f.write(xml.getvalue())
+            generated.xmlFiles.append(xmlPath)
+            generated.xmlBytes += os.path.getsize(xmlPath)
+            generated.elementCount += xml.elementCount
+            pakFiles.append({ "name": f"{xmlIndex}.yax", "type": 0 })
+        with open(os.path.join(pakDir, "pakInfo.json"), "w") as f:
+            json.dump({ "files": pakFiles }, f, indent=4)
+        memberNames.append(pakName)
+
+    extensions = ["bin", "bxm", "mrb", "wmb", "wtp"]
+    for i in range(extraMembers):
+        memberNames.append(f"m{i:05d}.{extensions[i % len(extensions)]}")
+
+    for name in memberNames:
+        path = os.path.join(folder, name)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(rng.randint(memberSize // 2, memberSize)))
+        generated.memberFiles.append(path)
+        generated.memberBytes += os.path.getsize(path)
+
+    if metadata == "json":
+        with open(os.path.join(folder, "dat_info.json"), "w") as f:
+            json.dump({ "version": 1, "files": memberNames, "basename": "benchmark", "ext": "dat" }, f, indent=4)
+    else:
+        writeFileOrderMetadata(os.path.join(folder, "file_order.metadata"), memberNames)
+
+    return generated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic dat folder")
+    parser.add_argument("folder")
+    parser.add_argument("--paks", type=int, default=20)
+    parser.add_argument("--xmls", type=int, default=10, help="xml files per pak")
+    parser.add_argument("--elements", type=int, default=500, help="elements per xml file")
+    parser.add_argument("--ids", type=int, default=30, help="id definitions per xml file")
+    parser.add_argument("--refs", type=int, default=30, help="id references per xml file")
+    parser.add_argument("--members", type=int, default=100, help="dat members besides the paks")
+    parser.add_argument("--member-size", type=int, default=64 * 1024, help="maximum size of a dat member in bytes")
+    parser.add_argument("--metadata", choices=["json", "metadata"], default="json", help="dat_info.json or file_order.metadata")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generated = generateDatFolder(
+        args.folder, args.paks, args.xmls, args.elements, args.ids, args.refs,
+        args.members, args.member_size, args.metadata, args.seed
+    )
+    print(f"{len(generated.xmlFiles)} xml files ({generated.elementCount} elements), {len(generated.memberFiles)} dat members ({generated.memberBytes / 1024 / 1024:.1f} MB)")
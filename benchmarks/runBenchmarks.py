@@ -0,0 +1,184 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generateDatFolder import GeneratedFolder, generateDatFolder
+from nier2blender2nier.datHashGenerator import generateHashData
+from nier2blender2nier.exportDat import export_dat, export_dat_incremental
+from nier2blender2nier.util import importContentsFileFromFolder
+from pakWarningsChecker import WarningsChecker
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+MB = 1024 * 1024
+
+def measure(
+    run: Callable[[Any], None], setup: Callable[[], Any], amounts: Dict[str, float], repeat: int
+) -> Dict[str, Any]:
+    """Best time of repeat runs, throughput per amount unit and the peak of Python allocations of one extra run"""
+    times = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        # warm up caches
+        run(setup())
+        for _ in range(repeat):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+        state = setup()
+        tracemalloc.start()
+        run(state)
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    seconds = min(times)
+    return {
+        "seconds": seconds,
+        "peakMemory": peakMemory,
+        "throughput": { unit: amount / seconds for unit, amount in amounts.items() },
+    }
+
+def touch(file: str) -> None:
+    stat = os.stat(file)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+def benchmarkChecker(generated: GeneratedFolder, workers: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    folder = generated.folder
+    amounts = {
+        "files/s": len(generated.xmlFiles),
+        "MB/s": generated.xmlBytes / MB,
+        "elements/s": generated.elementCount,
+    }
+    results = {}
+
+    def newChecker(streaming: bool) -> WarningsChecker:
+        return WarningsChecker(workers, streaming)
+    results["checker cold"] = measure(lambda checker: checker.check(folder), lambda: newChecker(False), amounts, repeat)
+    results["checker cold streaming"] = measure(lambda checker: checker.check(folder), lambda: newChecker(True), amounts, repeat)
+
+    def warmChecker() -> WarningsChecker:
+        checker = newChecker(False)
+        checker.check(folder)
+        return checker
+    results["checker unchanged"] = measure(lambda checker: checker.check(folder), warmChecker, { "files/s": len(generated.xmlFiles) }, repeat)
+
+    def changedChecker() -> WarningsChecker:
+        checker = warmChecker()
+        touch(generated.xmlFiles[len(generated.xmlFiles) // 2])
+        return checker
+    results["checker one changed"] = measure(lambda checker: checker.check(folder), changedChecker, { "files/s": len(generated.xmlFiles) }, repeat)
+    return results
+
+def benchmarkHashData(nameCount: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    extensions = ["bin", "bxm", "mrb", "wmb", "wtp", "pak"]
+    names = [f"file_{i:06d}.{extensions[i % len(extensions)]}" for i in range(nameCount)]
+    def run(_):
+        hashData = generateHashData(names)
+        hashData.write(io.BytesIO())
+    return { "hash map": measure(run, lambda: None, { "names/s": nameCount }, repeat) }
+
+def benchmarkDatExport(generated: GeneratedFolder, workDir: str, repeat: int) -> Dict[str, Dict[str, Any]]:
+    files = importContentsFileFromFolder(generated.folder)
+    datPath = os.path.join(workDir, "benchmark.dat")
+    amounts = { "files/s": len(files), "MB/s": generated.memberBytes / MB }
+    results = {}
+    results["dat export"] = measure(lambda _: export_dat(datPath, files), lambda: None, amounts, repeat)
+
+    # one member changes, but keeps its size
+    changedFile = files[len(files) // 2]
+    def changeOne():
+        with open(changedFile, "r+b") as f:
+            data = bytearray(f.read(16))
+            data[0] ^= 0xFF
+            f.seek(0)
+            f.write(data)
+    results["dat patch one changed"] = measure(lambda _: export_dat_incremental(datPath, files, [changedFile]), changeOne, { "files/s": len(files) }, repeat)
+    return results
+
+def formatMemory(size: int) -> str:
+    return f"{size / MB:.1f} MB"
+
+def printResults(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], maxSlowdown: float) -> List[str]:
+    """Prints a table of all results and returns the names of the ones that got slower than allowed"""
+    regressions = []
+    print(f"{'benchmark':<24} {'time':>9} {'peak memory':>12}  {'vs baseline':>11}  throughput")
+    for name, result in results.items():
+        throughput = ", ".join(f"{value:,.1f} {unit}" for unit, value in result["throughput"].items())
+        comparison = ""
+        if name in baseline:
+            change = result["seconds"] / baseline[name]["seconds"] - 1
+            comparison = f"{change:+.1%}"
+            if change > maxSlowdown:
+                comparison += " !"
+                regressions.append(name)
+        print(f"{name:<24} {result['seconds'] * 1000:>7.1f}ms {formatMemory(result['peakMemory']):>12}  {comparison:>11}  {throughput}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the warnings checker, hash map generation and dat export on a synthetic dat folder")
+    parser.add_argument("--paks", type=int, default=20)
+    parser.add_argument("--xmls", type=int, default=10, help="xml files per pak")
+    parser.add_argument("--elements", type=int, default=500, help="elements per xml file")
+    parser.add_argument("--ids", type=int, default=30, help="id definitions per xml file")
+    parser.add_argument("--refs", type=int, default=30, help="id references per xml file")
+    parser.add_argument("--members", type=int, default=100, help="dat members besides the paks")
+    parser.add_argument("--member-size", type=int, default=64 * 1024, help="maximum size of a dat member in bytes")
+    parser.add_argument("--hash-names", type=int, default=10000, help="file names for the hash map benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="warnings checker processes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--folder", help="generate the dat folder here and keep it")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="allowed slowdown compared to the baseline, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    config = {
+        "paks": args.paks, "xmls": args.xmls, "elements": args.elements, "ids": args.ids, "refs": args.refs,
+        "members": args.members, "memberSize": args.member_size, "hashNames": args.hash_names, "workers": args.workers,
+    }
+    workDir = tempfile.mkdtemp(prefix="datBenchmark")
+    folder = args.folder or os.path.join(workDir, "dat")
+    try:
+        generated = generateDatFolder(
+            folder, args.paks, args.xmls, args.elements, args.ids, args.refs, args.members, args.member_size
+        )
+        print(
+            f"{len(generated.xmlFiles)} xml files ({generated.elementCount} elements, {generated.xmlBytes / MB:.1f} MB), "
+            f"{len(generated.memberFiles)} dat members ({generated.memberBytes / MB:.1f} MB)\n"
+        )
+        results = {}
+        results.update(benchmarkChecker(generated, args.workers, args.repeat))
+        results.update(benchmarkHashData(args.hash_names, args.repeat))
+        results.update(benchmarkDatExport(generated, workDir, args.repeat))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baselineData = json.load(f)
+        if baselineData["config"] != config:
+            print(f"{args.baseline} was recorded with different settings, not comparing\n")
+        else:
+            baseline = baselineData["results"]
+    regressions = printResults(results, baseline, args.max_slowdown)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({ "config": config, "results": results }, f, indent=4)
+        print(f"\nSaved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmarks are more than {args.max_slowdown:.0%} slower than the baseline")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
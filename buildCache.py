@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+CACHE_VERSION = 2
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hashFiles(files: Iterable[str]) -> str:
+    # content hash of one or more files, missing files count as empty
+    hasher = hashlib.blake2b(digest_size=16)
+    for file in files:
+        hasher.update(os.path.basename(file).encode("utf-8") + b"\x00")
+        if not os.path.isfile(file):
+            continue
+        with open(file, "rb") as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+def hashFile(file: str) -> str:
+    return hashFiles([file])
+
+def hashContent(file: str, data: bytes) -> str:
+    # same as hashFile, for a file whose content is already in memory
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(os.path.basename(file).encode("utf-8") + b"\x00")
+    hasher.update(data)
+    return hasher.hexdigest()
+
+def hashMemberHashes(memberHashes: Dict[str, str]) -> str:
+    # one hash over the member order and all member hashes of a dat
+    hasher = hashlib.blake2b(digest_size=16)
+    for file, memberHash in memberHashes.items():
+        hasher.update(os.path.basename(file).encode("utf-8") + b"\x00" + memberHash.encode("ascii"))
+    return hasher.hexdigest()
+
+def getFileStamp(file: str) -> Tuple[int, int]:
+    stat = os.stat(file)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def getCachePath(watchDir: str) -> str:
+    # next to the watched folder, so that writing it doesn't trigger the watcher
+    return os.path.normpath(os.path.abspath(watchDir)) + ".buildCache.json"
+
+class BuildCache:
+    """
+    Remembers for every artifact (yax, pak, mrb) the hash of the inputs it was built from
+    and the hash of its content. Build steps are skipped if their inputs didn't change
+    and the artifact is still the one that was built.
+    """
+    path: str
+    # artifact path -> {"input": input hash, "output": artifact hash, "stamp": artifact (mtime, size)}
+    # dats additionally have "members": {member path: content hash}, their content isn't hashed
+    entries: Dict[str, dict]
+    # input path -> [mtime, size, hash], unchanged inputs aren't read again
+    inputHashes: Dict[str, list]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.inputHashes = {}
+        # build steps run in parallel
+        self.lock = Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"Ignoring invalid build cache {self.path}")
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        self.entries = data["entries"]
+        self.inputHashes = data["inputHashes"]
+
+    def save(self) -> None:
+        tmpPath = self.path + ".tmp"
+        with self.lock:
+            data = json.dumps({ "version": CACHE_VERSION, "entries": self.entries, "inputHashes": self.inputHashes })
+        with open(tmpPath, "w") as f:
+            f.write(data)
+        os.replace(tmpPath, self.path)
+
+    def hashInput(self, file: str) -> str:
+        # content hash of an input, only rehashed if the file has been touched since
+        try:
+            stamp = list(getFileStamp(file))
+        except FileNotFoundError:
+            return hashFile(file)
+        with self.lock:
+            entry = self.inputHashes.get(file)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+        inputHash = hashFile(file)
+        with self.lock:
+            self.inputHashes[file] = stamp + [inputHash]
+        return inputHash
+
+    def hashInputs(self, files: Iterable[str]) -> str:
+        hasher = hashlib.blake2b(digest_size=16)
+        for file in files:
+            hasher.update(os.path.basename(file).encode("utf-8") + b"\x00")
+            hasher.update(self.hashInput(file).encode("ascii"))
+        return hasher.hexdigest()
+
+    def getArtifactHash(self, artifact: str) -> str:
+        # artifact hash, only rehashed if the file has been touched since
+        entry = self.entries.get(artifact)
+        stamp = list(getFileStamp(artifact))
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["output"]
+        return hashFile(artifact)
+
+    def contains(self, artifact: str) -> bool:
+        return artifact in self.entries
+
+    def isUnchanged(self, artifact: str) -> bool:
+        """Whether the file is an artifact that hasn't been touched since it was built."""
+        with self.lock:
+            entry = self.entries.get(artifact)
+        if entry is None:
+            return False
+        try:
+            return entry["stamp"] == list(getFileStamp(artifact))
+        except FileNotFoundError:
+            return False
+
+    def isUpToDate(self, artifact: str, inputHash: str) -> bool:
+        entry = self.entries.get(artifact)
+        if entry is None or entry["input"] != inputHash:
+            return False
+        if not os.path.exists(artifact):
+            return False
+        return self.getArtifactHash(artifact) == entry["output"]
+
+    def update(self, artifact: str, inputHash: str, data: bytes = None) -> bool:
+        """
+        Records a freshly built artifact, data is its content if it's already in memory.
+        Returns whether its content changed.
+        """
+        outputHash = hashFile(artifact) if data is None else hashContent(artifact, data)
+        stamp = list(getFileStamp(artifact))
+        with self.lock:
+            entry = self.entries.get(artifact)
+            self.entries[artifact] = {
+                "input": inputHash,
+                "output": outputHash,
+                "stamp": stamp,
+            }
+            # the next step doesn't have to read it again to hash its inputs (e.g. yax -> pak)
+            self.inputHashes[artifact] = stamp + [outputHash]
+        return entry is None or entry["output"] != outputHash
+
+    def hashMembers(self, files: Iterable[str]) -> Dict[str, str]:
+        # content hashes of the members of a dat, unchanged members are only stat'ed
+        return { file: self.hashInput(file) for file in files }
+
+    def isDatUpToDate(self, datFile: str, memberHashes: Dict[str, str]) -> bool:
+        """Whether the dat has been exported from exactly these members and hasn't been touched since."""
+        with self.lock:
+            entry = self.entries.get(datFile)
+        if entry is None or entry["input"] != hashMemberHashes(memberHashes):
+            return False
+        try:
+            return entry["stamp"] == list(getFileStamp(datFile))
+        except FileNotFoundError:
+            return False
+
+    def getChangedMembers(self, datFile: str, memberHashes: Dict[str, str]) -> List[str]:
+        """Members that changed since the last successful export, all if the dat has been touched since."""
+        with self.lock:
+            entry = self.entries.get(datFile)
+        try:
+            if entry is None or entry["stamp"] != list(getFileStamp(datFile)):
+                return list(memberHashes)
+        except FileNotFoundError:
+            return list(memberHashes)
+        exported = entry["members"]
+        return [file for file, memberHash in memberHashes.items() if exported.get(file) != memberHash]
+
+    def updateDat(self, datFile: str, memberHashes: Dict[str, str]) -> None:
+        # records a successful export
+        stamp = list(getFileStamp(datFile))
+        with self.lock:
+            self.entries[datFile] = {
+                "input": hashMemberHashes(memberHashes),
+                "output": None,
+                "stamp": stamp,
+                "members": memberHashes,
+            }
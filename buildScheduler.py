@@ -0,0 +1,97 @@
+from __future__ import annotations
+from concurrent.futures import Executor
+from threading import Event, Lock
+import traceback
+from typing import Any, Callable, Dict, Iterable, List
+
+class BuildTask:
+    name: str
+    # called with the results of all dependencies
+    action: Callable[..., Any]
+    dependencies: List[BuildTask]
+    dependents: List[BuildTask]
+    # pending, running, done, failed or skipped (a dependency didn't finish)
+    state: str
+    result: Any
+    error: BaseException
+
+    def __init__(self, name: str, action: Callable[..., Any], dependencies: Iterable[BuildTask]):
+        self.name = name
+        self.action = action
+        self.dependencies = list(dependencies)
+        self.dependents = []
+        self.state = "pending"
+        self.result = None
+        self.error = None
+
+class BuildScheduler:
+    """
+    Runs build steps on an executor as soon as all their dependencies are done.
+    Independent steps run at the same time.
+    """
+    executor: Executor
+    tasks: List[BuildTask]
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.tasks = []
+        self.lock = Lock()
+        self.allDone = Event()
+        self.remainingTasks = 0
+        self.waitingFor: Dict[BuildTask, int] = {}
+
+    def addTask(self, name: str, action: Callable[..., Any], dependencies: Iterable[BuildTask] = ()) -> BuildTask:
+        task = BuildTask(name, action, dependencies)
+        for dependency in task.dependencies:
+            dependency.dependents.append(task)
+        self.tasks.append(task)
+        return task
+
+    def run(self) -> List[BuildTask]:
+        """Runs all tasks and waits for them. Returns the failed tasks."""
+        if not self.tasks:
+            return []
+        self.allDone.clear()
+        self.remainingTasks = len(self.tasks)
+        self.waitingFor = { task: len(task.dependencies) for task in self.tasks }
+        for task in self.tasks:
+            if not task.dependencies:
+                self.start(task)
+        self.allDone.wait()
+        return [task for task in self.tasks if task.state == "failed"]
+
+    def start(self, task: BuildTask) -> None:
+        task.state = "running"
+        self.executor.submit(self.runTask, task)
+
+    def runTask(self, task: BuildTask) -> None:
+        try:
+            task.result = task.action(*[dependency.result for dependency in task.dependencies])
+            task.state = "done"
+        except BaseException as e:
+            print(f"Error in {task.name}")
+            traceback.print_exc()
+            task.error = e
+            task.state = "failed"
+        self.finish(task)
+
+    def finish(self, task: BuildTask) -> None:
+        finishedTasks = [task]
+        while finishedTasks:
+            finished = finishedTasks.pop()
+            readyTasks = []
+            with self.lock:
+                for dependent in finished.dependents:
+                    self.waitingFor[dependent] -= 1
+                    if self.waitingFor[dependent] == 0:
+                        readyTasks.append(dependent)
+                self.remainingTasks -= 1
+                if self.remainingTasks == 0:
+                    self.allDone.set()
+
+            for ready in readyTasks:
+                if all(dependency.state == "done" for dependency in ready.dependencies):
+                    self.start(ready)
+                else:
+                    ready.state = "skipped"
+                    finishedTasks.append(ready)
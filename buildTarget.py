@@ -0,0 +1,370 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+from threading import Lock
+from typing import ContextManager, Dict, List, Set
+
+from NierDocs.tools.pakScriptTools.xmlToYax import xmlToYax
+from NierDocs.tools.pakScriptTools.pakRepacker import repackPak
+from nier2blender2nier.exportDat import export_dat, export_dat_incremental
+
+from diagnostics import CheckResult, printDiagnosticChanges, printDiagnostics, writeDiagnosticsJson
+from pakWarningsChecker import WarningsChecker, getDisplayName
+from artifactStore import ArtifactStore
+from buildCache import BuildCache, getCachePath
+from buildScheduler import BuildScheduler, BuildTask
+from buildTrace import BuildTrace, StageEvent
+from fileIndex import FileIndex
+from pakRegistry import PakInfo, PakRegistry, getPathKey
+from scriptCompiler import ScriptCache, compileToBytes, getScriptCachePath
+from watchSnapshot import getSnapshotPath, loadSnapshot, saveSnapshot
+
+# diagnostics and build steps of parallel tasks are printed one after another
+printLock = Lock()
+
+def printStep(message: str):
+    with printLock:
+        print(message)
+
+def backupFile(file: str):
+    # copy the original file to <file>.bak the first time
+    backupFile = file + ".bak"
+    if not os.path.exists(backupFile):
+        shutil.copy(file, backupFile)
+
+class BuildTarget:
+    """
+    A dat folder and the dat it is exported to. Every target has its own
+    build cache, pakInfo.json registry and warnings checker.
+    The registry and checker are saved between runs, so that after a restart
+    only files that changed in the meantime are parsed and built again.
+    """
+    folder: str
+    # None if no dat is exported
+    datFile: str
+    buildCache: BuildCache
+    # pak and mrb files of the current rebuild, for the dat export
+    artifacts: ArtifactStore
+    fileIndex: FileIndex
+    pakRegistry: PakRegistry
+    checker: WarningsChecker
+    trace: BuildTrace
+    # diagnostics are additionally appended to it as json lines, if set
+    diagnosticsFile: str
+    # threads that copy the files of big dats
+    exportWorkers: int
+    # registry or checker changed since the watcher state was saved
+    snapshotOutdated: bool
+    # a build step ran since the last save
+    hasChanges: bool
+    # compiled mrb files by source hash, shared by all runs
+    scriptCache: ScriptCache
+    # None to compile in the build thread
+    scriptPool: ProcessPoolExecutor
+
+    def __init__(
+        self, folder: str, datFile: str, trace: BuildTrace, checkerWorkers: int = 1,
+        checkerPool: ProcessPoolExecutor = None, diagnosticsFile: str = None, exportWorkers: int = 1,
+        scriptPool: ProcessPoolExecutor = None
+    ):
+        self.folder = folder
+        self.folderKey = getPathKey(folder)
+        self.datFile = datFile
+        self.trace = trace
+        self.diagnosticsFile = diagnosticsFile
+        self.exportWorkers = exportWorkers
+        self.scriptPool = scriptPool
+        self.scriptCache = ScriptCache(getScriptCachePath(folder))
+        self.buildCache = BuildCache(getCachePath(folder))
+        self.artifacts = ArtifactStore()
+        self.snapshotPath = getSnapshotPath(folder)
+        self.snapshotOutdated = False
+        self.hasChanges = False
+        snapshot = loadSnapshot(self.snapshotPath)
+        self.fileIndex = FileIndex(folder)
+        self.checker = WarningsChecker(checkerWorkers, pool=checkerPool)
+        self.pakRegistry = None
+        if snapshot is not None:
+            try:
+                self.checker.setState(snapshot["checker"])
+                self.pakRegistry = PakRegistry(folder, snapshot["registry"], self.fileIndex.pakInfoFiles.values())
+            except (KeyError, TypeError, ValueError):
+                print(f"Ignoring invalid watcher state {self.snapshotPath}")
+                self.checker = WarningsChecker(checkerWorkers, pool=checkerPool)
+        if self.pakRegistry is None:
+            self.pakRegistry = PakRegistry(folder, None, self.fileIndex.pakInfoFiles.values())
+
+    def owns(self, file: str) -> bool:
+        return getPathKey(file).startswith(self.folderKey + os.sep)
+
+    def checkWarnings(self, onlyChanges: bool = False) -> CheckResult:
+        """Checks all pak xml files and prints all diagnostics, or only the new and resolved ones."""
+        result = self.checker.check(self.folder, self.pakRegistry.xmlFiles)
+        with printLock:
+            if onlyChanges:
+                printDiagnosticChanges(result)
+                if self.diagnosticsFile is not None:
+                    writeDiagnosticsJson(self.diagnosticsFile, result.new, "new")
+                    writeDiagnosticsJson(self.diagnosticsFile, result.resolved, "resolved")
+            else:
+                printDiagnostics(result.diagnostics)
+                if self.diagnosticsFile is not None:
+                    writeDiagnosticsJson(self.diagnosticsFile, result.diagnostics, "active")
+        return result
+
+    def stage(self, stage: str, name: str) -> ContextManager[StageEvent]:
+        # every step that does something is traced
+        self.hasChanges = True
+        return self.trace.stage(stage, name)
+
+    def save(self) -> None:
+        # called after every rebuild, the watcher state is saved later by saveWatchState
+        self.artifacts.clear()
+        self.scriptCache.prune()
+        self.buildCache.save()
+        self.snapshotOutdated = True
+        self.hasChanges = False
+
+    def saveWatchState(self) -> None:
+        # takes longer than an incremental check, so it is only saved while idle and on exit
+        if self.snapshotOutdated:
+            saveSnapshot(self.snapshotPath, self.pakRegistry, self.checker)
+            self.snapshotOutdated = False
+
+    def findSourceFiles(self) -> List[str]:
+        # all files that are built from, inputs that didn't change are only stat'ed
+        files = []
+        for pak in self.pakRegistry.paks.values():
+            files.append(pak.infoPath)
+            files.extend(pak.xmlFiles)
+        files.extend(self.findScriptFiles())
+        return files
+
+    def findScriptFiles(self) -> List[str]:
+        return list(self.fileIndex.scriptFiles.values())
+
+    def applyEvents(self, files: Set[str]) -> Set[str]:
+        """
+        Updates the file index. Returns the changed files, including the files of created or deleted folders,
+        without the artifacts that were just built.
+        """
+        changedFiles = self.fileIndex.update(files)
+        return { file for file in changedFiles if not self.isBuiltArtifact(file) }
+
+    def isBuiltArtifact(self, file: str) -> bool:
+        # yax, pak, mrb and dat files (and their backups) written by the build steps themselves
+        if file.endswith(".bak"):
+            return self.buildCache.contains(file[:-4])
+        return self.buildCache.isUnchanged(file)
+
+    def addStartupTasks(self, scheduler: BuildScheduler) -> None:
+        """Adds the steps to build everything that changed while not watching."""
+        files = self.findSourceFiles()
+        self.adoptArtifacts(files)
+        self.addBuildTasks(scheduler, set(files), checkWarnings=False)
+
+    def addFullBuildTasks(self, scheduler: BuildScheduler) -> None:
+        """Adds the steps to build everything, whether it is up to date or not."""
+        yaxTasks: Dict[str, List[BuildTask]] = {}
+        datInputTasks: List[BuildTask] = []
+        for pak in self.pakRegistry.paks.values():
+            tasks = yaxTasks.setdefault(pak.pakDir, [])
+            for file in pak.xmlFiles:
+                if not os.path.exists(file):
+                    continue
+                yaxFile = file[:-4] + ".yax"
+                tasks.append(scheduler.addTask(
+                    f"converting {os.path.basename(file)}",
+                    lambda file=file, yaxFile=yaxFile: self.convertXml(file, yaxFile, rebuild=True)
+                ))
+        for file in self.findScriptFiles():
+            datInputTasks.append(scheduler.addTask(
+                f"compiling {os.path.basename(file)}",
+                lambda file=file: self.compileScript(file, rebuild=True)
+            ))
+        for pak in self.pakRegistry.paks.values():
+            datInputTasks.append(scheduler.addTask(
+                f"repacking {pak.pakDir}",
+                lambda *yaxChanges, pak=pak: self.repackPakDir(pak, rebuild=True),
+                yaxTasks[pak.pakDir]
+            ))
+        # the checker only reads the xml files, so it doesn't have to wait for anything
+        scheduler.addTask(f"checking warnings in {self.folder}", lambda: self.checkChangedWarnings(True, onlyChanges=False))
+        if self.datFile is not None:
+            scheduler.addTask(f"exporting {self.datFile}", self.exportFullDat, datInputTasks)
+
+    def adoptArtifacts(self, files: List[str]) -> None:
+        # artifacts that have never been built by the watcher are assumed to be up to date
+        cache = self.buildCache
+        for file in files:
+            if file.endswith(".xml"):
+                artifact = file[:-4] + ".yax"
+            elif file.endswith(".rb"):
+                artifact = file[:-3]
+            else:
+                continue
+            if not cache.contains(artifact) and os.path.exists(artifact) and os.path.exists(file):
+                cache.update(artifact, cache.hashInput(file))
+        for pak in self.pakRegistry.paks.values():
+            if not cache.contains(pak.pakFile) and os.path.exists(pak.pakFile):
+                cache.update(pak.pakFile, cache.hashInputs([pak.infoPath] + pak.yaxFiles))
+
+    def addBuildTasks(self, scheduler: BuildScheduler, pendingFiles: Set[str], checkWarnings: bool = True) -> None:
+        """Adds the steps to rebuild everything that depends on the changed files."""
+        # xml -> yax -> pak -> dat and rb -> mrb -> dat
+        # independent steps run in parallel, each step starts once its inputs are built
+        xmlTasks: List[BuildTask] = []
+        yaxTasks: Dict[str, List[BuildTask]] = {}
+        changedPaks: Dict[str, PakInfo] = {}
+        changedPakInfoDirs = set()
+        # a registered xml or pakInfo.json was deleted, its warnings change
+        removedSources = False
+        datInputTasks: List[BuildTask] = []
+        for file in pendingFiles:
+            if file.endswith("pakInfo.json"):
+                wasRegistered = getPathKey(file) in self.pakRegistry.paks
+                pak = self.pakRegistry.refresh(file)
+                if pak is not None:
+                    changedPaks[pak.pakDir] = pak
+                    changedPakInfoDirs.add(pak.pakDir)
+                elif wasRegistered:
+                    removedSources = True
+                continue
+            if not os.path.exists(file):
+                # deleted or only a temporary file
+                # looked up without refreshing, the pakInfo.json of a deleted folder might come later
+                if file.endswith(".xml") and getPathKey(file) in self.pakRegistry.pakByXml:
+                    removedSources = True
+                continue
+            fileName = os.path.basename(file)
+            if file.endswith(".xml"):
+                # check if file is in pakInfo.json
+                pak = self.pakRegistry.findPakOfXml(file)
+                if pak is None:
+                    continue
+                yaxFile = file[:-4] + ".yax"
+                task = scheduler.addTask(f"converting {fileName}", lambda file=file, yaxFile=yaxFile: self.convertXml(file, yaxFile))
+                xmlTasks.append(task)
+                if pak.pakDir.endswith(".pak"):
+                    changedPaks[pak.pakDir] = pak
+                    yaxTasks.setdefault(pak.pakDir, []).append(task)
+
+            elif file.endswith(".rb"):
+                datInputTasks.append(scheduler.addTask(f"compiling {fileName}", lambda file=file: self.compileScript(file)))
+
+        for dirName, pak in changedPaks.items():
+            # waits for the yax files, but repacks whenever the pak doesn't match them, also after a failed repack
+            datInputTasks.append(scheduler.addTask(
+                f"repacking {dirName}",
+                lambda *yaxChanges, pak=pak: self.repackPakDir(pak),
+                yaxTasks.get(dirName, [])
+            ))
+        if checkWarnings and (xmlTasks or changedPakInfoDirs or removedSources):
+            force = len(changedPakInfoDirs) > 0 or removedSources
+            scheduler.addTask(f"checking warnings in {self.folder}", lambda *yaxChanges: self.checkChangedWarnings(force, *yaxChanges), xmlTasks)
+        if self.datFile is not None and pendingFiles:
+            # exported whenever the dat doesn't match its members, also after an export failed
+            scheduler.addTask(f"exporting {self.datFile}", self.exportDat, datInputTasks)
+
+    def convertXml(self, file: str, yaxFile: str, rebuild: bool = False):
+        # None if the yax is up to date, otherwise whether its content changed
+        inputHash = self.buildCache.hashInput(file)
+        if not rebuild and self.buildCache.isUpToDate(yaxFile, inputHash):
+            return None
+        printStep(f"Converting {getDisplayName(file)} to yax")
+        with self.stage("xmlToYax", os.path.basename(file)) as stage:
+            xmlToYax(file, yaxFile)
+            stage.read([file])
+            stage.written([yaxFile])
+        # the yax isn't a dat member, it's only read to hash it
+        return self.buildCache.update(yaxFile, inputHash, self.artifacts.read(yaxFile, keep=False))
+
+    def repackPakDir(self, pak: PakInfo, rebuild: bool = False) -> str:
+        # returns the pak file if it changed
+        pakFile = pak.pakFile
+        inputHash = self.buildCache.hashInputs([pak.infoPath] + pak.yaxFiles)
+        if not rebuild and self.buildCache.isUpToDate(pakFile, inputHash):
+            return None
+        printStep(f"Repacking {pakFile}")
+        backupFile(pakFile)
+        with self.stage("repackPak", os.path.basename(pakFile)) as stage:
+            repackPak(pak.pakDir)
+            stage.read([pak.infoPath] + pak.yaxFiles)
+            stage.written([pakFile])
+        data = self.artifacts.read(pakFile, keep=self.datFile is not None)
+        return pakFile if self.buildCache.update(pakFile, inputHash, data) else None
+
+    def compileScript(self, file: str, rebuild: bool = False) -> str:
+        # returns the mrb file if it changed
+        mrbBinFile = file[:-3]
+        inputHash = self.buildCache.hashInput(file)
+        if not rebuild and self.buildCache.isUpToDate(mrbBinFile, inputHash):
+            return None
+        with self.stage("compileFile", os.path.basename(file)) as stage:
+            # scripts that are changed back or built again have already been compiled
+            data = self.scriptCache.get(inputHash)
+            if data is None:
+                printStep(f"Compiling {getDisplayName(file)}")
+                if self.scriptPool is not None:
+                    data = self.scriptPool.submit(compileToBytes, file).result()
+                else:
+                    data = compileToBytes(file)
+                self.scriptCache.put(inputHash, data)
+            stage.read([file])
+            if self.isFileContent(mrbBinFile, data):
+                # e.g. only comments changed, the mrb and the dat stay as they are
+                self.buildCache.update(mrbBinFile, inputHash, data)
+                return None
+            backupFile(mrbBinFile)
+            with open(mrbBinFile, "wb") as f:
+                f.write(data)
+            stage.written([mrbBinFile])
+        if self.datFile is not None:
+            self.artifacts.add(mrbBinFile, data)
+        return mrbBinFile if self.buildCache.update(mrbBinFile, inputHash, data) else None
+
+    def isFileContent(self, file: str, data: bytes) -> bool:
+        # whether the file on disk has exactly this content
+        try:
+            if os.path.getsize(file) != len(data):
+                return False
+            with open(file, "rb") as f:
+                return f.read() == data
+        except FileNotFoundError:
+            return False
+
+    def checkChangedWarnings(self, force: bool, *yaxChanges, onlyChanges: bool = True) -> None:
+        if force or any(change is not None for change in yaxChanges):
+            with self.stage("checkWarnings", self.folder) as stage:
+                stage.read(self.checkWarnings(onlyChanges).parsedFiles)
+
+    def exportDat(self, *changedFiles) -> None:
+        # the events of the rebuilt files haven't arrived yet
+        self.fileIndex.update(file for file in changedFiles if file is not None)
+        files = self.fileIndex.getDatMembers()
+        memberHashes = self.buildCache.hashMembers(files)
+        if self.buildCache.isDatUpToDate(self.datFile, memberHashes):
+            return
+        # todo: Should probably check for file extensions
+        #Extensions bigger than 4 characters may mess things up
+        changedDatFiles = self.buildCache.getChangedMembers(self.datFile, memberHashes)
+        with self.stage("exportDat", os.path.basename(self.datFile)) as stage:
+            buffers = self.artifacts.getAll(changedDatFiles)
+            stage.bytesWritten += export_dat_incremental(
+                self.datFile, files, changedDatFiles, self.fileIndex.getStats(files), buffers, self.exportWorkers
+            )
+            stage.read(file for file in changedDatFiles if file not in buffers)
+            stage.files.update(buffers)
+            stage.files.add(self.datFile)
+        self.buildCache.updateDat(self.datFile, memberHashes)
+
+    def exportFullDat(self, *changedFiles) -> None:
+        self.fileIndex.update(file for file in changedFiles if file is not None)
+        with self.stage("exportDat", os.path.basename(self.datFile)) as stage:
+            files = self.fileIndex.getDatMembers()
+            buffers = self.artifacts.getAll(files)
+            stage.bytesWritten += export_dat(self.datFile, files, skip_identical=True, file_buffers=buffers, workers=self.exportWorkers)
+            stage.read(file for file in files if file not in buffers)
+            stage.files.update(buffers)
+            stage.files.add(self.datFile)
+        self.buildCache.updateDat(self.datFile, self.buildCache.hashMembers(files))
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Set
+
+def formatSize(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+class StageEvent:
+    """One run of a pipeline stage, e.g. converting one xml file"""
+    stage: str
+    name: str
+    threadId: int
+    # seconds since the start of the trace
+    start: float
+    duration: float
+    bytesRead: int
+    bytesWritten: int
+    files: Set[str]
+
+    def __init__(self, stage: str, name: str, start: float):
+        self.stage = stage
+        self.name = name
+        self.threadId = threading.get_ident()
+        self.start = start
+        self.duration = 0
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.files = set()
+
+    def read(self, files: Iterable[str]) -> None:
+        # sizes of input files, call after the stage read them
+        for file in files:
+            self.files.add(file)
+            if os.path.isfile(file):
+                self.bytesRead += os.path.getsize(file)
+
+    def written(self, files: Iterable[str]) -> None:
+        # sizes of output files, call after the stage wrote them
+        for file in files:
+            self.files.add(file)
+            if os.path.isfile(file):
+                self.bytesWritten += os.path.getsize(file)
+
+class BuildTrace:
+    """
+    Records wall time, bytes read/written and touched files of every pipeline stage.
+    Prints a summary per rebuild and can be saved in the Chrome trace event format
+    (chrome://tracing, ui.perfetto.dev).
+    """
+    events: List[StageEvent]
+    rebuilds: List[StageEvent]
+    threadNames: Dict[int, str]
+
+    def __init__(self):
+        self.events = []
+        self.rebuilds = []
+        self.threadNames = {}
+        self.startTime = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def now(self) -> float:
+        return time.perf_counter() - self.startTime
+
+    @contextmanager
+    def stage(self, stage: str, name: str) -> Iterator[StageEvent]:
+        event = StageEvent(stage, name, self.now())
+        try:
+            yield event
+        finally:
+            event.duration = self.now() - event.start
+            with self.lock:
+                self.events.append(event)
+                self.threadNames.setdefault(event.threadId, threading.current_thread().name)
+
+    @contextmanager
+    def rebuild(self) -> Iterator[StageEvent]:
+        firstEvent = len(self.events)
+        event = StageEvent("rebuild", "rebuild", self.now())
+        try:
+            yield event
+        finally:
+            event.duration = self.now() - event.start
+            with self.lock:
+                self.rebuilds.append(event)
+                self.threadNames.setdefault(event.threadId, threading.current_thread().name)
+                stageEvents = self.events[firstEvent:]
+            self.printSummary(event, stageEvents)
+
+    def printSummary(self, rebuild: StageEvent, stageEvents: List[StageEvent]) -> None:
+        if not stageEvents:
+            return
+        stages: Dict[str, List[StageEvent]] = {}
+        for event in stageEvents:
+            stages.setdefault(event.stage, []).append(event)
+        print(f"Rebuild took {rebuild.duration:.2f}s")
+        for stage, events in stages.items():
+            duration = sum(event.duration for event in events)
+            bytesRead = sum(event.bytesRead for event in events)
+            bytesWritten = sum(event.bytesWritten for event in events)
+            fileCount = len(set().union(*(event.files for event in events)))
+            print(
+                f"  {stage:<14} {len(events):>4}x {duration:>7.2f}s "
+                f"{formatSize(bytesRead):>10} read {formatSize(bytesWritten):>10} written {fileCount:>5} files"
+            )
+
+    def writeChromeTrace(self, path: str) -> None:
+        pid = os.getpid()
+        with self.lock:
+            events = self.rebuilds + self.events
+            threadNames = dict(self.threadNames)
+        traceEvents = [
+            { "name": "thread_name", "ph": "M", "pid": pid, "tid": threadId, "args": { "name": name } }
+            for threadId, name in threadNames.items()
+        ]
+        for event in events:
+            traceEvents.append({
+                "name": event.name,
+                "cat": event.stage,
+                "ph": "X",
+                "ts": event.start * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": pid,
+                "tid": event.threadId,
+                "args": {
+                    "bytesRead": event.bytesRead,
+                    "bytesWritten": event.bytesWritten,
+                    "files": len(event.files),
+                },
+            })
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({ "traceEvents": traceEvents, "displayTimeUnit": "ms" }, f)
+        os.replace(tmpPath, path)
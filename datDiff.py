@@ -0,0 +1,24 @@
+import sys
+
+from nier2blender2nier.datArchive import DatArchive, diffDatArchives
+
+def printDatDiff(oldDat: str, newDat: str) -> bool:
+    with DatArchive(oldDat) as old, DatArchive(newDat) as new:
+        diff = diffDatArchives(old, new)
+        for name in diff.added:
+            print(f"+ {name} ({new.fileSizes[new.indexOf(name)]} bytes)")
+        for name in diff.removed:
+            print(f"- {name} ({old.fileSizes[old.indexOf(name)]} bytes)")
+        for name in diff.changed:
+            oldSize = old.fileSizes[old.indexOf(name)]
+            newSize = new.fileSizes[new.indexOf(name)]
+            print(f"~ {name} ({oldSize} -> {newSize} bytes, crc32 {old.checksum(name):08x} -> {new.checksum(name):08x})")
+        print(f"{len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed, {len(diff.unchanged)} unchanged")
+        return diff.isEmpty
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python datDiff.py <old_dat> <new_dat>")
+        sys.exit(2)
+    isSame = printDatDiff(sys.argv[1], sys.argv[2])
+    sys.exit(0 if isSame else 1)
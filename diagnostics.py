@@ -0,0 +1,90 @@
+from collections import Counter
+import json
+import os
+from typing import Iterable, List
+
+class Diagnostic:
+    """One finding of a check in a pak xml"""
+    __slots__ = ("file", "path", "rule", "severity", "message")
+    file: str
+    # element tags from the root, e.g. root/nodes/node, empty if it's about the whole file
+    path: str
+    # name of the check, e.g. duplicate-id
+    rule: str
+    # warning or error
+    severity: str
+    message: str
+
+    def __init__(self, file: str, path: str, rule: str, message: str, severity: str = "warning"):
+        self.file = file
+        self.path = path
+        self.rule = rule
+        self.severity = severity
+        self.message = message
+
+    def getState(self) -> list:
+        # json data, Diagnostic(*state) restores it
+        return [self.file, self.path, self.rule, self.message, self.severity]
+
+    def key(self) -> tuple:
+        return (self.file, self.path, self.rule, self.severity, self.message)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Diagnostic) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def format(self, resolved: bool = False) -> str:
+        fileName = os.path.basename(self.file)
+        if resolved:
+            # green text
+            return f"\033[32m{fileName}:\tRESOLVED {self.severity.upper()}: {self.message}\033[0m"
+        # orange text
+        return f"\033[33m{fileName}:\t{self.severity.upper()}: {self.message}\033[0m"
+
+    def toJson(self, status: str) -> str:
+        return json.dumps({
+            "status": status,
+            "file": self.file,
+            "path": self.path,
+            "rule": self.rule,
+            "severity": self.severity,
+            "message": self.message,
+        })
+
+class CheckResult:
+    """All diagnostics of a check and what changed since the previous check"""
+    diagnostics: List[Diagnostic]
+    new: List[Diagnostic]
+    resolved: List[Diagnostic]
+    # the files that had to be parsed again
+    parsedFiles: List[str]
+
+    def __init__(self, diagnostics: List[Diagnostic], previousDiagnostics: List[Diagnostic], parsedFiles: List[str]):
+        self.diagnostics = diagnostics
+        self.parsedFiles = parsedFiles
+        # the same diagnostic can appear several times in a file
+        current = Counter(diagnostics)
+        previous = Counter(previousDiagnostics)
+        self.new = list((current - previous).elements())
+        self.resolved = list((previous - current).elements())
+
+def printDiagnostics(diagnostics: Iterable[Diagnostic]) -> None:
+    for diagnostic in diagnostics:
+        print(diagnostic.format())
+
+def printDiagnosticChanges(result: CheckResult) -> None:
+    if not result.new and not result.resolved:
+        return
+    for diagnostic in result.new:
+        print(diagnostic.format())
+    for diagnostic in result.resolved:
+        print(diagnostic.format(resolved=True))
+    print(f"{len(result.diagnostics)} warnings ({len(result.new)} new, {len(result.resolved)} resolved)")
+
+def writeDiagnosticsJson(path: str, diagnostics: Iterable[Diagnostic], status: str) -> None:
+    # appends one json object per line, status is active, new or resolved
+    with open(path, "a", encoding="utf-8") as f:
+        for diagnostic in diagnostics:
+            f.write(diagnostic.toJson(status) + "\n")
@@ -0,0 +1,119 @@
+import os
+import stat
+from typing import Dict, Iterable, List, Set, Tuple
+
+from nier2blender2nier.util import readFileOrderMetadata, readJsonDatInfo
+from pakRegistry import getPathKey
+
+METADATA_FILES = ("dat_info.json", "file_order.metadata")
+
+class FileIndex:
+    """
+    The files of a dat folder that builds need, scanned once with os.scandir and
+    then kept up to date from file events: all pakInfo.json and ruby files, and the
+    stats of the files directly in the folder (the dat members and metadata).
+    Not thread safe, only the thread that applies events and exports the dat may use it.
+    """
+    folder: str
+    folderKey: str
+    # path key -> path, in os.walk order
+    pakInfoFiles: Dict[str, str]
+    scriptFiles: Dict[str, str]
+    # path key -> stat, of files directly in the folder
+    memberStats: Dict[str, os.stat_result]
+    # dat members in dat order, read again when the metadata file changed
+    datMembers: List[str]
+    datMembersStamp: Tuple[str, int, int]
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.folderKey = getPathKey(folder)
+        self.pakInfoFiles = {}
+        self.scriptFiles = {}
+        self.memberStats = {}
+        self.datMembers = []
+        self.datMembersStamp = None
+        self.scanDir(folder)
+
+    def scanDir(self, dir: str) -> List[str]:
+        # adds all files below dir and returns them, files of a folder before its sub folders like os.walk
+        files = []
+        subDirs = []
+        try:
+            with os.scandir(dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subDirs.append(entry.path)
+                    else:
+                        files.append(entry.path)
+                        self.addFile(entry.path, entry)
+        except OSError:
+            return files
+        for subDir in subDirs:
+            files.extend(self.scanDir(subDir))
+        return files
+
+    def addFile(self, path: str, entry: os.DirEntry = None) -> None:
+        key = getPathKey(path)
+        if path.endswith("pakInfo.json"):
+            self.pakInfoFiles[key] = path
+        elif path.endswith(".rb"):
+            self.scriptFiles[key] = path
+        if os.path.dirname(key) == self.folderKey:
+            # other files are only stat'ed when they are built
+            self.memberStats[key] = entry.stat() if entry is not None else os.stat(path)
+
+    def removeFile(self, key: str) -> None:
+        self.pakInfoFiles.pop(key, None)
+        self.scriptFiles.pop(key, None)
+        self.memberStats.pop(key, None)
+
+    def update(self, paths: Iterable[str]) -> Set[str]:
+        """
+        Applies created, modified, deleted or moved files and folders.
+        Returns the changed files, including the files below created and deleted folders.
+        """
+        changedFiles = set()
+        for path in paths:
+            try:
+                pathStat = os.stat(path)
+            except OSError:
+                # deleted, either a file or a folder with all files below
+                key = getPathKey(path)
+                prefix = key + os.sep
+                for files in (self.pakInfoFiles, self.scriptFiles):
+                    for fileKey, file in list(files.items()):
+                        if fileKey.startswith(prefix):
+                            changedFiles.add(file)
+                            del files[fileKey]
+                self.removeFile(key)
+                changedFiles.add(path)
+                continue
+            if stat.S_ISDIR(pathStat.st_mode):
+                changedFiles.update(self.scanDir(path))
+            else:
+                self.addFile(path)
+                changedFiles.add(path)
+        return changedFiles
+
+    def getDatMembers(self) -> List[str]:
+        """The dat member files in dat order, same as importContentsFileFromFolder"""
+        for name in METADATA_FILES:
+            metadataFile = os.path.join(self.folder, name)
+            metadataStat = self.memberStats.get(getPathKey(metadataFile))
+            if metadataStat is not None:
+                break
+        else:
+            raise Exception(f"No metadata file found in {self.folder}")
+        stamp = (name, metadataStat.st_mtime_ns, metadataStat.st_size)
+        if stamp != self.datMembersStamp:
+            if name == "dat_info.json":
+                self.datMembers = readJsonDatInfo(metadataFile)
+            else:
+                self.datMembers = readFileOrderMetadata(metadataFile)
+            self.datMembersStamp = stamp
+        return self.datMembers
+
+    def getStats(self, files: List[str]) -> List[os.stat_result]:
+        # files outside of the index are stat'ed
+        return [self.memberStats.get(getPathKey(file)) or os.stat(file) for file in files]
@@ -1,143 +1,288 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import json
 import os
-import pathlib
+from queue import Empty, Queue
 import sys
 import time
-import shutil
-from threading import Lock, Timer
+from threading import Thread
 import traceback
-from typing import Set
+from typing import Dict, List, Set
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from MrubyDecompiler import compileFile
-from NierDocs.tools.pakScriptTools.xmlToYax import xmlToYax
-from NierDocs.tools.pakScriptTools.pakRepacker import repackPak
-from nier2blender2nier.exportDat import export_dat
-from nier2blender2nier.util import importContentsFileFromFolder
+from buildScheduler import BuildScheduler
+from buildTarget import BuildTarget
+from buildTrace import BuildTrace
 
-from pakWarningsChecker import checkWarningsInFolder
+# shared by all targets
+buildPool: ThreadPoolExecutor = None
+checkerPool: ProcessPoolExecutor = None
+# ruby scripts are compiled in their own processes, so that they don't hold the GIL of the build threads
+scriptPool: ProcessPoolExecutor = None
+buildTrace = BuildTrace()
+# Chrome trace of all rebuilds, rewritten after every rebuild
+traceFile: str = None
+# json lines of all diagnostics
+diagnosticsFile: str = None
+# wait until no events arrived for this long before rebuilding,
+# up to the maximum during event storms (e.g. git checkout)
+MIN_QUIET_PERIOD = 0.15
+MAX_QUIET_PERIOD = 2.0
+STORM_EVENT_COUNT = 100
+# the watcher state is saved once no events arrived for this long
+SNAPSHOT_DELAY = 5.0
 
-watchDir: str = None
-datFile: str = None
-mutex = Lock()
+def readWorkspace(workspaceFile: str) -> List[dict]:
+    """
+    Reads the targets of a workspace file:
+    { "targets": [ { "folder": "<dat folder>", "dat": "<optional out dat>" }, ... ] }
+    Relative paths are relative to the workspace file.
+    """
+    with open(workspaceFile, "r") as f:
+        workspace = json.load(f)
+    workspaceDir = os.path.dirname(os.path.abspath(workspaceFile))
+    targets = []
+    for target in workspace["targets"]:
+        folder = os.path.join(workspaceDir, target["folder"])
+        datFile = os.path.join(workspaceDir, target["dat"]) if target.get("dat") else None
+        targets.append({ "folder": folder, "dat": datFile })
+    return targets
 
-def backupFile(file: str):
-    # copy the original file to <file>.bak the first time
-    backupFile = file + ".bak"
-    if not os.path.exists(backupFile):
-        shutil.copy(file, backupFile)
+def getQuietPeriod(eventCount: int) -> float:
+    return min(MAX_QUIET_PERIOD, MIN_QUIET_PERIOD * (1 + eventCount / STORM_EVENT_COUNT))
 
-def debounce(wait):
+class FileChangeHandler(FileSystemEventHandler):
     """
-    https://gist.github.com/walkermatt/2871026
-    Decorator that will postpone a functions
-    execution until after wait seconds
-    have elapsed since the last time it was invoked.
+    Collects file events of all targets on a queue. A single worker merges them
+    per path and rebuilds once no new events arrived for a while.
     """
-    def decorator(fn):
-        def debounced(*args, **kwargs):
-            def call_it():
+    targets: List[BuildTarget]
+    events: Queue
+    worker: Thread
+
+    def __init__(self, targets: List[BuildTarget]):
+        # nested folders belong to the innermost target
+        self.targets = sorted(targets, key=lambda target: len(target.folderKey), reverse=True)
+        self.events = Queue()
+        self.worker = Thread(target=self.processEvents, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.events.put((time.monotonic(), None))
+        self.worker.join()
+
+    def addEvent(self, path: str):
+        self.events.put((time.monotonic(), path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.addEvent(event.src_path)
+
+    # created, deleted and moved folders update the file index of their target
+    def on_created(self, event):
+        self.addEvent(event.src_path)
+
+    def on_deleted(self, event):
+        self.addEvent(event.src_path)
+
+    def on_moved(self, event):
+        # editors that save atomically write a temp file and move it over the original
+        self.addEvent(event.src_path)
+        self.addEvent(event.dest_path)
+
+    def processEvents(self):
+        isStopping = False
+        while not isStopping:
+            # saved on this thread, so that it never runs during a rebuild
+            hasOutdatedSnapshots = any(target.snapshotOutdated for target in self.targets)
+            try:
+                firstEventTime, path = self.events.get(timeout=SNAPSHOT_DELAY if hasOutdatedSnapshots else None)
+            except Empty:
+                self.saveWatchStates()
+                continue
+            if path is None:
+                break
+            pendingFiles = { path }
+            eventCount = 1
+            lastEventTime = firstEventTime
+            while True:
                 try:
-                    fn(*args, **kwargs)
-                except:
-                    print("Error in debounced function")
-                    traceback.print_exc()
-                    if mutex.locked():
-                        mutex.release()
+                    eventTime, path = self.events.get(timeout=getQuietPeriod(eventCount))
+                except Empty:
+                    break
+                if path is None:
+                    isStopping = True
+                    break
+                pendingFiles.add(path)
+                eventCount += 1
+                lastEventTime = eventTime
+
             try:
-                debounced.t.cancel()
-            except AttributeError:
-                pass
-            debounced.t = Timer(wait, call_it)
-            debounced.t.start()
-        return debounced
-    return decorator
+                hasRebuilt = self.handlePendingFiles(pendingFiles)
+            except Exception:
+                print("Error while rebuilding")
+                traceback.print_exc()
+                continue
+            if hasRebuilt:
+                now = time.monotonic()
+                print(f"Rebuilt {now - lastEventTime:.2f}s after the last change ({now - firstEventTime:.2f}s after the first, {eventCount} events)")
+        self.saveWatchStates()
 
+    def saveWatchStates(self):
+        for target in self.targets:
+            try:
+                target.saveWatchState()
+            except Exception:
+                print(f"Error while saving the watcher state of {target.folder}")
+                traceback.print_exc()
 
-class FileChangeHandler(FileSystemEventHandler):
-    pendingFiles: Set[str]
+    def findTarget(self, file: str) -> BuildTarget:
+        for target in self.targets:
+            if target.owns(file):
+                return target
+        return None
 
-    def __init__(self):
-        self.pendingFiles = set()
+    def handlePendingFiles(self, pendingFiles: Set[str]) -> bool:
+        """Rebuilds everything that depends on the changed files. Returns whether anything had to be built."""
+        # only the targets that own a changed file are rebuilt, all of them in one schedule
+        filesByTarget: Dict[BuildTarget, Set[str]] = {}
+        for file in pendingFiles:
+            target = self.findTarget(file)
+            if target is not None:
+                filesByTarget.setdefault(target, set()).add(file)
+        scheduler = BuildScheduler(buildPool)
+        for target, files in filesByTarget.items():
+            target.addBuildTasks(scheduler, target.applyEvents(files))
 
-    def on_modified(self, event):
-        if event.is_directory:
-            return
-        mutex.acquire()
-        self.pendingFiles.add(event.src_path)
-        mutex.release()
-        self.handlePendingFiles()
-    
-    @debounce(0.15)
-    def handlePendingFiles(self):
-        mutex.acquire()
-        hasDatChanged = False
-        changedPakDirs = set()
-        for file in self.pendingFiles:
-            fileName = os.path.basename(file)
-            if file.endswith(".xml"):
-                # check if file is in pakInfo.json
-                infoPath = os.path.join(os.path.dirname(file), "pakInfo.json")
-                if not os.path.exists(infoPath):
-                    continue
-                with open(infoPath, "r") as f:
-                    pakInfo = json.load(f)
-                yaxFile = file[:-4] + ".yax"
-                yaxFileName = os.path.basename(yaxFile)
-                if not any(yaxFileName in file["name"] for file in pakInfo["files"]):
-                    continue
-                # convert xml to yax
-                print(f"Converting {fileName} to yax")
-                xmlToYax(file, yaxFile)
-                dirName = os.path.dirname(file)
-                if dirName.endswith(".pak"):
-                    changedPakDirs.add(dirName)
-
-            elif file.endswith("pakInfo.json"):
-                changedPakDirs.add(os.path.dirname(file))
-
-            elif file.endswith(".rb"):
-                mrbBinFile = file[:-3]
-                print(f"Compiling {fileName}")
-                backupFile(mrbBinFile)
-                compileFile(file, mrbBinFile)
-                hasDatChanged = True
-            
-        for dirName in changedPakDirs:
-            pakFileName = pathlib.Path(dirName).parts[-1]
-            pakFile = str(pathlib.Path(dirName).parent.parent / pakFileName)
-            print(f"Repacking {pakFile}")
-            backupFile(pakFile)
-            repackPak(dirName)
-            hasDatChanged = True
-        if len(changedPakDirs) > 0:
-            checkWarningsInFolder(watchDir)
-        if datFile is not None and hasDatChanged:
-            # todo: Should probably check for file extensions
-            #Extensions bigger than 4 characters may mess things up
-            export_dat(datFile, importContentsFileFromFolder(watchDir))
-        self.pendingFiles.clear()
-        mutex.release()
-        
+        if not scheduler.tasks:
+            return False
+        with buildTrace.rebuild():
+            scheduler.run()
+        # e.g. a touched pak that is still exported in the dat
+        rebuiltTargets = [target for target in filesByTarget.keys() if target.hasChanges]
+        if not rebuiltTargets:
+            return False
+        for target in rebuiltTargets:
+            target.save()
+        if traceFile is not None:
+            buildTrace.writeChromeTrace(traceFile)
+        return True
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <directory> [<out_dat>]")
-        sys.exit(1)
-    watchDir = sys.argv[1]
-    if len(sys.argv) > 2:
-        datFile = sys.argv[2]
-    handler = FileChangeHandler()
+def getTargetConfigs(parser: argparse.ArgumentParser, args: argparse.Namespace) -> List[dict]:
+    if args.workspace is not None:
+        return readWorkspace(args.workspace)
+    if args.directory is not None:
+        return [{ "folder": args.directory, "dat": args.out_dat }]
+    parser.error("either a directory or --workspace is required")
+
+def createTargets(targetConfigs: List[dict], buildWorkers: int, checkerWorkers: int) -> List[BuildTarget]:
+    global buildPool, checkerPool, scriptPool
+    buildPool = ThreadPoolExecutor(max_workers=buildWorkers)
+    if checkerWorkers > 1:
+        checkerPool = ProcessPoolExecutor(max_workers=checkerWorkers)
+    if buildWorkers > 1:
+        scriptPool = ProcessPoolExecutor(max_workers=buildWorkers)
+    return [
+        BuildTarget(config["folder"], config["dat"], buildTrace, checkerWorkers, checkerPool, diagnosticsFile, buildWorkers, scriptPool)
+        for config in targetConfigs
+    ]
+
+def shutdownPools():
+    buildPool.shutdown()
+    if checkerPool is not None:
+        checkerPool.shutdown()
+    if scriptPool is not None:
+        scriptPool.shutdown()
+
+def build(targets: List[BuildTarget], warningsAsErrors: bool) -> int:
+    """Builds everything of all targets once. Returns the exit code."""
+    scheduler = BuildScheduler(buildPool)
+    for target in targets:
+        target.addFullBuildTasks(scheduler)
+    with buildTrace.rebuild():
+        failedTasks = scheduler.run()
+    for target in targets:
+        target.save()
+        target.saveWatchState()
+    if traceFile is not None:
+        buildTrace.writeChromeTrace(traceFile)
+
+    if failedTasks:
+        print(f"Build failed: {', '.join(task.name for task in failedTasks)}")
+        return 1
+    warningCount = sum(len(target.checker.diagnostics) for target in targets)
+    if warningsAsErrors and warningCount > 0:
+        print(f"Build failed with {warningCount} warnings")
+        return 1
+    return 0
+
+def watch(targets: List[BuildTarget]):
+    # catch up on changes since the last run, then check once
+    scheduler = BuildScheduler(buildPool)
+    for target in targets:
+        target.addStartupTasks(scheduler)
+    with buildTrace.rebuild():
+        scheduler.run()
+    for target in targets:
+        target.checkWarnings()
+        target.save()
+
+    handler = FileChangeHandler(targets)
     observer = Observer()
-    checkWarningsInFolder(watchDir)
-    observer.schedule(handler, watchDir, recursive=True)
+    for target in targets:
+        observer.schedule(handler, target.folder, recursive=True)
     observer.start()
-    print(f"Watching {watchDir}")
+    for target in targets:
+        print(f"Watching {target.folder}")
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    handler.stop()
+
+if __name__ == '__main__':
+    isBuild = len(sys.argv) > 1 and sys.argv[1] == "build"
+    if isBuild:
+        parser = argparse.ArgumentParser(prog="main.py build", description="Builds everything in dat folders once and exits")
+        parser.add_argument("directory", nargs="?", help="extracted dat folder")
+        parser.add_argument("out_dat", nargs="?", help="dat file to export to")
+        parser.add_argument("--workspace", metavar="workspace.json", help="build all dat folders listed in a workspace file instead")
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of parallel build steps, checker processes and dat copy threads")
+        parser.add_argument("--warnings-as-errors", action="store_true", help="exit with 1 if there are any warnings")
+        parser.add_argument("--trace", metavar="out.json", help="write the timings of the build in the Chrome trace event format")
+        parser.add_argument("--diagnostics", metavar="out.jsonl", help="append all warnings as json lines")
+        args = parser.parse_args(sys.argv[2:])
+    else:
+        parser = argparse.ArgumentParser(description="Watches dat folders and rebuilds changed files")
+        parser.add_argument("directory", nargs="?", help="extracted dat folder")
+        parser.add_argument("out_dat", nargs="?", help="dat file to export to after every rebuild")
+        parser.add_argument("--workspace", metavar="workspace.json", help="watch all dat folders listed in a workspace file instead")
+        parser.add_argument("--trace", metavar="out.json", help="write the timings of all rebuilds in the Chrome trace event format")
+        parser.add_argument("--diagnostics", metavar="out.jsonl", help="append all warnings at startup and new and resolved ones after every rebuild as json lines")
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of parallel build steps and dat copy threads")
+        parser.add_argument("--checker-workers", type=int, default=os.cpu_count() or 1, help="number of processes that parse pak xmls for the warnings check, 1 to parse them in the main process")
+        args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs has to be at least 1")
+    # build mode uses the same number of checker processes as build steps
+    checkerWorkers = args.jobs if isBuild else args.checker_workers
+    if checkerWorkers < 1:
+        parser.error("--checker-workers has to be at least 1")
+    targetConfigs = getTargetConfigs(parser, args)
+    traceFile = args.trace
+    diagnosticsFile = args.diagnostics
+
+    targets = createTargets(targetConfigs, args.jobs, checkerWorkers)
+    try:
+        if isBuild:
+            exitCode = build(targets, args.warnings_as_errors)
+        else:
+            watch(targets)
+            exitCode = 0
+    finally:
+        shutdownPools()
+    sys.exit(exitCode)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+from functools import cached_property
+import mmap
+import os
+import struct
+from typing import Dict, List, Tuple
+import zlib
+
+from nier2blender2nier.datHashGenerator import HashData
+
+class DatArchive:
+    """Read only, memory mapped view of a .dat/.dtt file. Tables are parsed on first access."""
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            self.file.close()
+            raise ValueError(f"{path} is not a dat file")
+        self.view = memoryview(self.data)
+        if self.view[:4] != b"DAT\x00":
+            self.close()
+            raise ValueError(f"{path} is not a dat file")
+
+    def close(self):
+        self.view.release()
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self) -> DatArchive:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.fileNumber
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def unpackTable(self, format: str, count: int, offset: int) -> Tuple:
+        # like struct.unpack_from, but a table outside of the file is a ValueError
+        tableFormat = f"<{count}{format}"
+        if count < 0 or offset < 0 or offset + struct.calcsize(tableFormat) > self.size:
+            raise ValueError(f"{self.path} is truncated or corrupt")
+        return struct.unpack_from(tableFormat, self.data, offset)
+
+    @cached_property
+    def header(self) -> Tuple[int, int, int, int, int, int]:
+        # fileNumber, fileOffsetsOffset, fileExtensionsOffset, fileNamesOffset, fileSizesOffset, hashMapOffset
+        return self.unpackTable("i", 6, 4)
+
+    @property
+    def fileNumber(self) -> int:
+        return self.header[0]
+
+    @property
+    def hashMapOffset(self) -> int:
+        return self.header[5]
+
+    @cached_property
+    def fileOffsets(self) -> List[int]:
+        return list(self.unpackTable("i", self.fileNumber, self.header[1]))
+
+    @cached_property
+    def fileExtensions(self) -> List[str]:
+        extensions = []
+        offset = self.header[2]
+        for _ in range(self.fileNumber):
+            end = self.data.find(b"\x00", offset)
+            if offset < 0 or end == -1:
+                raise ValueError(f"{self.path} is truncated or corrupt")
+            extensions.append(self.data[offset:end].decode("utf-8"))
+            offset = end + 1
+        return extensions
+
+    @cached_property
+    def nameLength(self) -> int:
+        return self.unpackTable("i", 1, self.header[3])[0]
+
+    @cached_property
+    def fileNames(self) -> List[str]:
+        namesOffset = self.header[3] + 4
+        nameLength = self.nameLength
+        if nameLength < 0 or namesOffset + self.fileNumber * nameLength > self.size:
+            raise ValueError(f"{self.path} is truncated or corrupt")
+        names = []
+        for i in range(self.fileNumber):
+            offset = namesOffset + i * nameLength
+            name = self.data[offset:offset + nameLength]
+            names.append(name.split(b"\x00")[0].decode("utf-8"))
+        return names
+
+    @cached_property
+    def fileSizes(self) -> List[int]:
+        fileSizes = list(self.unpackTable("i", self.fileNumber, self.header[4]))
+        # the data of every file has to be inside of the dat
+        for offset, size in zip(self.fileOffsets, fileSizes):
+            if offset < 0 or size < 0 or offset + size > self.size:
+                raise ValueError(f"{self.path} is truncated or corrupt")
+        return fileSizes
+
+    @cached_property
+    def fileIndices(self) -> Dict[str, int]:
+        return { name: i for i, name in enumerate(self.fileNames) }
+
+    @cached_property
+    def hashData(self) -> HashData:
+        offset = self.hashMapOffset
+        preHashShift, bucketsOffset, hashesOffset, fileIndicesOffset = self.unpackTable("I", 4, offset)
+        if preHashShift > 31:
+            raise ValueError(f"{self.path} is truncated or corrupt")
+        bucketCount = 1 << (31 - preHashShift)
+        hashData = HashData(preHashShift)
+        hashData.bucketOffsets = list(self.unpackTable("h", bucketCount, offset + bucketsOffset))
+        hashData.hashes = list(self.unpackTable("I", self.fileNumber, offset + hashesOffset))
+        hashData.fileIndices = list(self.unpackTable("h", self.fileNumber, offset + fileIndicesOffset))
+        return hashData
+
+    def indexOf(self, name: str) -> int:
+        return self.fileIndices[name]
+
+    def getFile(self, nameOrIndex) -> memoryview:
+        # zero copy view of a files data, only valid until the archive is closed
+        i = nameOrIndex if isinstance(nameOrIndex, int) else self.indexOf(nameOrIndex)
+        offset = self.fileOffsets[i]
+        return self.view[offset:offset + self.fileSizes[i]]
+
+    def checksum(self, nameOrIndex) -> int:
+        return zlib.crc32(self.getFile(nameOrIndex)) & 0xFFFFFFFF
+
+class DatDiff:
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+    unchanged: List[str]
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.unchanged = []
+
+    @property
+    def isEmpty(self) -> bool:
+        return not self.added and not self.removed and not self.changed
+
+def diffDatArchives(old: DatArchive, new: DatArchive) -> DatDiff:
+    diff = DatDiff()
+    for name in new.fileNames:
+        if name not in old.fileIndices:
+            diff.added.append(name)
+        elif old.fileSizes[old.indexOf(name)] != new.fileSizes[new.indexOf(name)]:
+            diff.changed.append(name)
+        elif old.checksum(name) != new.checksum(name):
+            diff.changed.append(name)
+        else:
+            diff.unchanged.append(name)
+    for name in old.fileNames:
+        if name not in new.fileIndices:
+            diff.removed.append(name)
+    return diff
+
+def isFileEqual(filepath: str, data: memoryview) -> bool:
+    # compares a file on disk with data, without copying either
+    if os.path.getsize(filepath) != len(data):
+        return False
+    if len(data) == 0:
+        return True
+    with open(filepath, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fileData:
+            with memoryview(fileData) as fileView:
+                return fileView == data
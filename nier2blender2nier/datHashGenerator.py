@@ -1,19 +1,18 @@
-from typing import List
-from nier2blender2nier.ioUtils import write_uInt32, write_Int16
-import zlib
+from array import array
+from typing import Sequence
 import os
 
-def crc32(text: str) -> int:
-	return zlib.crc32(text.encode('ascii')) & 0xFFFFFFFF
+from nier2blender2nier.hashing import crc32
+from nier2blender2nier.ioUtils import write_int16_array, write_uint32_array
 
 def next_power_of_2_bits(x: int) -> int:  
     return 1 if x == 0 else (x - 1).bit_length()
 
 class HashData:
     preHashShift: int
-    bucketOffsets: List[int]
-    hashes: List[int]
-    fileIndices: List[int]
+    bucketOffsets: Sequence[int]
+    hashes: Sequence[int]
+    fileIndices: Sequence[int]
 
     def __init__(self, preHashShift: int):
         self.preHashShift = preHashShift
@@ -29,43 +28,32 @@ class HashData:
         hashesOffset = bucketsOffset + len(self.bucketOffsets)*2
         fileIndicesOffset = hashesOffset + len(self.hashes)*4
 
-        write_uInt32(file, self.preHashShift)
-        write_uInt32(file, bucketsOffset)
-        write_uInt32(file, hashesOffset)
-        write_uInt32(file, fileIndicesOffset)
+        write_uint32_array(file, (self.preHashShift, bucketsOffset, hashesOffset, fileIndicesOffset))
+        write_int16_array(file, self.bucketOffsets)
+        write_uint32_array(file, self.hashes)
+        write_int16_array(file, self.fileIndices)
 
-        for bucketOffset in self.bucketOffsets:
-            write_Int16(file, bucketOffset)
-        for hash in self.hashes:
-            write_uInt32(file, hash)
-        for fileIndex in self.fileIndices:
-            write_Int16(file, fileIndex)
-
-def generateHashData(files) -> bytes:
-    preHashShift = min(31, 32 - next_power_of_2_bits(len(files)))
+def generateHashData(files) -> HashData:
+    fileCount = len(files)
+    preHashShift = min(31, 32 - next_power_of_2_bits(fileCount))
     bucketOffsetsSize = 1 << (31 - preHashShift)
-    bucketOffsets = [-1] * bucketOffsetsSize
-    hashes = [0] * len(files)
-    fileIndices = list(range(len(files)))
-    fileNames = [os.path.basename(i) for i in files.copy()]
 
     # generate hashes
-    for i in range(len(files)):
-        fileName = os.path.basename(files[i])
-        hash = crc32(fileName.lower())
-        otherHash = (hash & 0x7FFFFFFF)
-        hashes[i] = otherHash
-    # sort by first half byte (x & 0x70000000)
-    # sort indices & hashes at the same time
-    hashes, fileIndices, fileNames = zip(*sorted(zip(hashes, fileIndices, fileNames), key=lambda x: x[0] & 0x70000000))
-    # generate bucket list
-    for i in range(len(files)):
-        bucketOffsetsIndex = hashes[i] >> preHashShift
-        if bucketOffsets[bucketOffsetsIndex] == -1:
-            bucketOffsets[bucketOffsetsIndex] = i
+    hashes = [crc32(os.path.basename(fp).lower()) & 0x7FFFFFFF for fp in files]
+    # stable sort by first half byte (x & 0x70000000)
+    sortKeys = [hash >> 28 for hash in hashes]
+    fileIndices = sorted(range(fileCount), key=sortKeys.__getitem__)
+    hashes = [hashes[i] for i in fileIndices]
+    # generate bucket list, each bucket points to its first hash
+    # (zipping in reverse order, so that the first index of a bucket is the one that's kept)
+    bucketIndices = [hash >> preHashShift for hash in hashes]
+    firstIndices = dict(zip(reversed(bucketIndices), range(fileCount - 1, -1, -1)))
+    bucketOffsets = array('h', [-1]) * bucketOffsetsSize
+    for bucketIndex, i in firstIndices.items():
+        bucketOffsets[bucketIndex] = i
 
     hashData = HashData(preHashShift)
     hashData.bucketOffsets = bucketOffsets
-    hashData.hashes = hashes
-    hashData.fileIndices = fileIndices
+    hashData.hashes = array('I', hashes)
+    hashData.fileIndices = array('h', fileIndices)
     return hashData
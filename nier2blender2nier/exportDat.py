@@ -1,45 +1,47 @@
 #A very slightly modified version of
 #https://github.com/WoefulWolf/NieR2Blender2NieR/blob/master/dat_dtt/exporter/export_dat.py
 
+from concurrent.futures import ThreadPoolExecutor
+import io
 import math
 import os
+import struct
 
-from nier2blender2nier.ioUtils import write_string, write_Int32, write_buffer, read_int32
+from nier2blender2nier.ioUtils import INT32, to_array_bytes, write_Int32, write_buffer
 
+COPY_CHUNK_SIZE = 1024 * 1024
+# smaller dats are written on one thread, it's not worth the overhead
+PARALLEL_COPY_MIN_SIZE = 16 * 1024 * 1024
+DAT_HEADER = struct.Struct('<4s6i')
 
 def to_string(bs, encoding = 'utf8'):
 	return bs.split(b'\x00')[0].decode(encoding)
 
-def export_dat(export_filepath, file_list):
-    files = file_list
+def get_dat_header(files, fileSizes):
+    # Returns the header, all tables and the hash map as one buffer and the file offsets
     fileNumber = len(files)
     from .datHashGenerator import generateHashData
     hashData = generateHashData(files)
 
-    fileExtensionsSize = 0
     fileExtensions = []
     for fp in files:
         fileExt = fp.split('.')[-1]
         fileExt += '\x00' * (3 - len(fileExt))
-        fileExtensionsSize += len(fileExt) + 1
-        fileExtensions.append(fileExt)
+        fileExtensions.append(fileExt.encode('utf-8') + b'\x00')
+    fileExtensionsSize = sum(len(fileExt) for fileExt in fileExtensions)
 
-    nameLength = 0                              
-    for fp in files:
-        fileName = os.path.basename(fp)
+    fileNames = [os.path.basename(fp).encode('utf-8') for fp in files]
+    nameLength = 0
+    for fileName in fileNames:
         if len(fileName)+1 > nameLength:
             nameLength = len(fileName)+1
 
-    fileNames = []                             
-    for fp in files:
-        fileName = os.path.basename(fp)
-        fileNames.append(fileName)
-
     hashMapSize = hashData.getStructSize()
+    hashMap = io.BytesIO()
+    hashData.write(hashMap)
+    hashMap = hashMap.getvalue()
 
     # Header
-    fileID = 'DAT'
-    fileNumber = fileNumber
     fileOffsetsOffset = 32
     fileExtensionsOffset = fileOffsetsOffset + (fileNumber * 4)
     fileNamesOffset = fileExtensionsOffset + fileExtensionsSize
@@ -49,59 +51,268 @@ def export_dat(export_filepath, file_list):
     #fileOffsets
     fileOffsets = []
     currentOffset = hashMapOffset + hashMapSize
-    for fp in files:
+    for size in fileSizes:
         currentOffset = (math.ceil(currentOffset / 16)) * 16
         fileOffsets.append(currentOffset)
-        currentOffset += os.path.getsize(fp)
-
-    # fileSizes
-    fileSizes = []
-    for fp in files:
-        fileSizes.append(os.path.getsize(fp))
+        currentOffset += size
 
     # WRITE
+    header = bytearray(hashMapOffset + len(hashMap))
         # Header
-    dat_file = open(export_filepath, 'wb')
-    write_string(dat_file, fileID)
-    write_Int32(dat_file, fileNumber)
-    write_Int32(dat_file, fileOffsetsOffset)
-    write_Int32(dat_file, fileExtensionsOffset)
-    write_Int32(dat_file, fileNamesOffset)
-    write_Int32(dat_file, fileSizesOffset)
-    write_Int32(dat_file, hashMapOffset)
-    write_buffer(dat_file, 4)
-
+    DAT_HEADER.pack_into(header, 0, b'DAT', fileNumber, fileOffsetsOffset, fileExtensionsOffset, fileNamesOffset, fileSizesOffset, hashMapOffset)
         # fileOffsets
-    for value in fileOffsets:
-        write_Int32(dat_file, value)
-
+    header[fileOffsetsOffset:fileOffsetsOffset + fileNumber * 4] = to_array_bytes('i', fileOffsets)
         # fileExtensions
-    for value in fileExtensions:
-        write_string(dat_file, value)
-
+    offset = fileExtensionsOffset
+    for fileExt in fileExtensions:
+        header[offset:offset + len(fileExt)] = fileExt
+        offset += len(fileExt)
         # nameLength
-    write_Int32(dat_file, nameLength)
-
+    INT32.pack_into(header, fileNamesOffset, nameLength)
         # fileNames
-    for value in fileNames:
-        write_string(dat_file, value)
-        if len(value) < nameLength:
-            write_buffer(dat_file, nameLength - len(value) - 1)
-
+    for i, fileName in enumerate(fileNames):
+        offset = fileNamesOffset + 4 + i * nameLength
+        header[offset:offset + len(fileName)] = fileName
         # fileSizes
-    for value in fileSizes:
-        write_Int32(dat_file, value)
-
+    header[fileSizesOffset:fileSizesOffset + fileNumber * 4] = to_array_bytes('i', fileSizes)
         # hashMap
-    hashData.write(dat_file)
+    header[hashMapOffset:] = hashMap
+
+    return header, fileOffsets
+
+def write_all(dst_fd, data, dst_offset, positional = False):
+    # Positional writes don't move the file position, so threads can write to the same dst_fd
+    view = memoryview(data)
+    written = 0
+    if not positional:
+        os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    while written < len(view):
+        if positional:
+            written += os.pwrite(dst_fd, view[written:], dst_offset + written)
+        else:
+            written += os.write(dst_fd, view[written:])
+
+def copy_file_into(src_filepath, dst_fd, dst_offset, size, positional = False):
+    # Copies a file to dst_offset in dst_fd, in the kernel if possible
+    with open(src_filepath, 'rb') as src_file:
+        src_fd = src_file.fileno()
+        copied = 0
+
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    count = os.copy_file_range(src_fd, dst_fd, size - copied, copied, dst_offset + copied)
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError:
+                pass
+
+        # sendfile writes at the file position of dst_fd
+        if copied < size and not positional and hasattr(os, 'sendfile'):
+            try:
+                os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+                while copied < size:
+                    count = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError:
+                pass
+
+        if copied < size:
+            buffer = memoryview(bytearray(min(COPY_CHUNK_SIZE, size - copied)))
+            src_file.seek(copied)
+            while copied < size:
+                count = src_file.readinto(buffer[:size - copied])
+                if not count:
+                    break
+                write_all(dst_fd, buffer[:count], dst_offset + copied, positional)
+                copied += count
 
-        # Files
-    for i, fp in enumerate(files):
-        dat_file.seek(fileOffsets[i])
-        fileData = open(fp, 'rb')
-        fileContent = fileData.read()
-        dat_file.write(fileContent)
-        fileData.close()
+def write_file_into(src_filepath, data, dst_fd, dst_offset, size, positional = False):
+    # Writes the file content if it's already in memory, otherwise copies the file
+    if data is None:
+        copy_file_into(src_filepath, dst_fd, dst_offset, size, positional)
+        return
+    write_all(dst_fd, memoryview(data)[:size], dst_offset, positional)
+
+def preallocate(dst_fd, size):
+    # Reserves the space of the whole file up front, so parallel writes don't fragment it
+    if size > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(dst_fd, 0, size)
+            return
+        except OSError:
+            # not supported by the file system
+            pass
+    os.ftruncate(dst_fd, size)
+
+def write_files_into(dst_fd, files, fileOffsets, fileSizes, buffers, workers = 1):
+    # Writes all files to their offsets, big dats in parallel if positional writes are possible
+    members = [(fp, offset, size) for fp, offset, size in zip(files, fileOffsets, fileSizes) if size > 0]
+    totalSize = sum(size for _, _, size in members)
+    if workers <= 1 or len(members) < 2 or totalSize < PARALLEL_COPY_MIN_SIZE or not hasattr(os, 'pwrite'):
+        for fp, offset, size in members:
+            write_file_into(fp, get_file_buffer(buffers, fp), dst_fd, offset, size)
+        return
+    # biggest files first, so that all threads finish at about the same time
+    members.sort(key=lambda member: member[2], reverse=True)
+    def write_member(member):
+        fp, offset, size = member
+        write_file_into(fp, get_file_buffer(buffers, fp), dst_fd, offset, size, positional=True)
+    with ThreadPoolExecutor(max_workers=min(workers, len(members))) as pool:
+        # list() raises the first error of any thread
+        list(pool.map(write_member, members))
+
+def get_file_buffers(file_buffers):
+    # file path -> content of files that are already in memory, by normalized path
+    if not file_buffers:
+        return {}
+    return { os.path.normcase(os.path.abspath(fp)): data for fp, data in file_buffers.items() }
+
+def get_file_buffer(buffers, fp):
+    if not buffers:
+        return None
+    return buffers.get(os.path.normcase(os.path.abspath(fp)))
+
+def is_file_content_equal(fp, data, view):
+    from .datArchive import isFileEqual
+    if data is not None:
+        return view == data
+    return isFileEqual(fp, view)
+
+def is_dat_identical(export_filepath, header, files, fileOffsets, fileSizes, datSize, buffers = None):
+    # checks if the existing dat already has exactly the content that would be written
+    from .datArchive import DatArchive
+    if not os.path.exists(export_filepath) or os.path.getsize(export_filepath) != datSize:
+        return False
+    try:
+        dat = DatArchive(export_filepath)
+    except ValueError:
+        return False
+    with dat:
+        if dat.view[:len(header)] != header:
+            return False
+        # padding between files has to be empty
+        previousEnd = len(header)
+        for fp, offset, size in zip(files, fileOffsets, fileSizes):
+            if offset > previousEnd and any(dat.view[previousEnd:offset]):
+                return False
+            if not is_file_content_equal(fp, get_file_buffer(buffers, fp), dat.view[offset:offset + size]):
+                return False
+            previousEnd = max(previousEnd, offset + size)
+    return True
+
+def export_dat(export_filepath, file_list, skip_identical = False, file_stats = None, file_buffers = None, workers = 1):
+    # Returns the number of bytes written
+    # file_stats are the already known os.stat results of file_list,
+    # file_buffers the contents of files that are already in memory (path -> bytes),
+    # files of big dats are copied on up to workers threads
+    files = file_list
+    buffers = get_file_buffers(file_buffers)
+    if file_stats is None:
+        file_stats = [os.stat(fp) for fp in files]
+    fileSizes = [stat.st_size for stat in file_stats]
+    header, fileOffsets = get_dat_header(files, fileSizes)
+
+    # the file ends with the last non empty file, or the header if there are none
+    datSize = len(header)
+    for offset, size in zip(fileOffsets, fileSizes):
+        if size > 0:
+            datSize = max(datSize, offset + size)
+
+    if skip_identical and is_dat_identical(export_filepath, header, files, fileOffsets, fileSizes, datSize, buffers):
+        print('DAT is already up to date. :)')
+        return 0
+
+    # the dat is written next to the old one and replaces it at once, so it's never half written
+    tmp_filepath = export_filepath + '.tmp'
+    try:
+        with open(tmp_filepath, 'wb') as dat_file:
+            dat_fd = dat_file.fileno()
+            preallocate(dat_fd, datSize)
+            dat_file.write(header)
+            dat_file.flush()
+            # Files
+            write_files_into(dat_fd, files, fileOffsets, fileSizes, buffers, workers)
+        os.replace(tmp_filepath, export_filepath)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
 
-    dat_file.close()
     print('DAT Export Complete. :)')
+    return len(header) + sum(fileSizes)
+
+def export_dat_incremental(export_filepath, file_list, changed_files = None, file_stats = None, file_buffers = None, workers = 1):
+    # Overwrites only changed files in an existing dat, if the file list is the same
+    # and every changed file still fits into its slot. Otherwise does a full export.
+    # Files are considered changed if they are in changed_files, their size changed
+    # or they have been modified after the dat. Files with the same content are skipped.
+    # Returns the number of bytes written
+    from .datArchive import DatArchive
+    files = file_list
+    buffers = get_file_buffers(file_buffers)
+    if not os.path.exists(export_filepath):
+        return export_dat(export_filepath, files, file_stats=file_stats, file_buffers=buffers, workers=workers)
+
+    datModified = os.path.getmtime(export_filepath)
+    changedFiles = set(os.path.normcase(os.path.abspath(fp)) for fp in changed_files or [])
+    try:
+        dat = DatArchive(export_filepath)
+    except ValueError:
+        return export_dat(export_filepath, files, file_stats=file_stats, file_buffers=buffers, workers=workers)
+    with dat:
+        try:
+            fileNames = dat.fileNames
+            fileOffsets = dat.fileOffsets
+            fileSizes = dat.fileSizes
+        except ValueError:
+            # truncated or corrupt dat
+            fileNames = None
+        if fileNames != [os.path.basename(fp) for fp in files]:
+            dat.close()
+            return export_dat(export_filepath, files, file_stats=file_stats, file_buffers=buffers, workers=workers)
+        fileSizesOffset = dat.header[4]
+        datSize = dat.size
+
+        patches = []
+        for i, fp in enumerate(files):
+            stat = file_stats[i] if file_stats is not None else os.stat(fp)
+            isChanged = (
+                stat.st_size != fileSizes[i] or
+                stat.st_mtime >= datModified or
+                os.path.normcase(os.path.abspath(fp)) in changedFiles
+            )
+            if not isChanged:
+                continue
+            # the last file can grow, all others have to fit before the next file
+            slotEnd = fileOffsets[i + 1] if i + 1 < len(files) else math.inf
+            if fileOffsets[i] + stat.st_size > slotEnd:
+                dat.close()
+                return export_dat(export_filepath, files, file_stats=file_stats, file_buffers=buffers, workers=workers)
+            if is_file_content_equal(fp, get_file_buffer(buffers, fp), dat.getFile(i)):
+                continue
+            patches.append((i, fp, stat.st_size))
+
+    if patches:
+        dat_file = open(export_filepath, 'r+b')
+        for i, fp, size in patches:
+            dat_file.flush()
+            write_file_into(fp, get_file_buffer(buffers, fp), dat_file.fileno(), fileOffsets[i], size)
+            # clear leftovers of the old file
+            if i + 1 < len(files):
+                dat_file.seek(fileOffsets[i] + size)
+                write_buffer(dat_file, max(0, fileSizes[i] - size))
+            elif fileOffsets[i] + size < datSize:
+                dat_file.truncate(fileOffsets[i] + size)
+
+            dat_file.seek(fileSizesOffset + i * 4)
+            write_Int32(dat_file, size)
+        dat_file.close()
+
+    # the dat counts as up to date even if nothing had to be written
+    os.utime(export_filepath)
+    print(f'DAT Patch Complete ({len(patches)} of {len(files)} files updated). :)')
+    return sum(size + 4 for i, fp, size in patches)
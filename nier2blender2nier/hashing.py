@@ -0,0 +1,40 @@
+from functools import lru_cache
+from typing import Dict, List
+import zlib
+
+@lru_cache(maxsize=1 << 16)
+def crc32(text: str) -> int:
+    # the same strings repeat across thousands of elements
+    return zlib.crc32(text.encode("ascii")) & 0xFFFFFFFF
+
+ACTION_CODE = "hap::Action"
+ENTITY_CODE = "app::EntityLayout"
+ACTION_CODE_HASH = crc32(ACTION_CODE)
+ENTITY_CODE_HASH = crc32(ENTITY_CODE)
+
+class ReverseHashIndex:
+    """Known strings by their crc32, from the str attributes of all files"""
+    # hash -> string -> number of files that contain it
+    strings: Dict[int, Dict[str, int]]
+
+    def __init__(self):
+        self.strings = {}
+        for text in (ACTION_CODE, ENTITY_CODE):
+            self.add(text)
+
+    def add(self, text: str) -> None:
+        counts = self.strings.setdefault(crc32(text), {})
+        counts[text] = counts.get(text, 0) + 1
+
+    def remove(self, text: str) -> None:
+        hash = crc32(text)
+        counts = self.strings[hash]
+        counts[text] -= 1
+        if counts[text] > 0:
+            return
+        del counts[text]
+        if not counts:
+            del self.strings[hash]
+
+    def find(self, hash: int) -> List[str]:
+        return sorted(self.strings.get(hash, ()))
@@ -1,54 +1,118 @@
 #https://github.com/WoefulWolf/NieR2Blender2NieR/blob/master/utils/ioUtils.py
 
 from __future__ import annotations
+from array import array
 import struct
-from typing import Any, List, Tuple
+import sys
+from typing import Any, List, Sequence, Tuple
+
+# Precompiled structs, so that format strings aren't parsed on every call
+
+INT8 = struct.Struct('<b')
+UINT8 = struct.Struct('B')
+UINT8_X4 = struct.Struct('BBBB')
+INT16 = struct.Struct('<h')
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+INT64 = struct.Struct('<q')
+UINT64 = struct.Struct('<Q')
+FLOAT16 = struct.Struct('<e')
+FLOAT = struct.Struct('<f')
+CHAR = struct.Struct('<s')
+BE_INT16 = struct.Struct('>h')
+BE_INT32 = struct.Struct('>i')
+BE_CHAR = struct.Struct('>c')
 
 # Little Endian
 
 def read_int8(file) -> int:
-    entry = file.read(1)
-    return struct.unpack('<b', entry)[0]
+    return INT8.unpack(file.read(1))[0]
 
 def read_uint8(file) -> int:
-    entry = file.read(1)
-    return struct.unpack('B', entry)[0]
+    return UINT8.unpack(file.read(1))[0]
 
 def read_uint8_x4(file) -> Tuple[int]:
-    entry = file.read(4)
-    return struct.unpack('BBBB', entry)
+    return UINT8_X4.unpack(file.read(4))
 
 def read_int16(file) -> int:
-    entry = file.read(2)
-    return struct.unpack('<h', entry)[0]
+    return INT16.unpack(file.read(2))[0]
 
 def read_uint16(file) -> int:
-    entry = file.read(2)
-    return struct.unpack('<H', entry)[0]
+    return UINT16.unpack(file.read(2))[0]
 
 def read_int32(file) -> int:
-    entry = file.read(4)
-    return struct.unpack('<i', entry)[0]
+    return INT32.unpack(file.read(4))[0]
 
 def read_uint32(file) -> int:
-    entry = file.read(4)
-    return struct.unpack('<I', entry)[0]
+    return UINT32.unpack(file.read(4))[0]
 
 def read_int64(file) -> int:
-    entry = file.read(8)
-    return struct.unpack('<q', entry)[0]
+    return INT64.unpack(file.read(8))[0]
 
 def read_uint64(file) -> int:
-    entry = file.read(8)
-    return struct.unpack('<Q', entry)[0]
+    return UINT64.unpack(file.read(8))[0]
 
 def read_float16(file) -> float:
-    entry = file.read(2)
-    return struct.unpack('<e', entry)[0]
+    return FLOAT16.unpack(file.read(2))[0]
 
 def read_float(file) -> float:
-    entry = file.read(4)
-    return struct.unpack('<f', entry)[0]
+    return FLOAT.unpack(file.read(4))[0]
+
+def read_into(file, buffer) -> int:
+    # fills a reusable buffer (bytearray, memoryview, array), returns the number of bytes read
+    view = memoryview(buffer).cast('B')
+    total = 0
+    while total < len(view):
+        count = file.readinto(view[total:])
+        if not count:
+            break
+        total += count
+    return total
+
+# Typed arrays, read and written in one call
+
+def to_array_bytes(typecode: str, values: Sequence[int]) -> bytes:
+    values = array(typecode, values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+def read_array(file, typecode: str, count: int) -> array:
+    values = array(typecode, [0]) * count
+    if read_into(file, values) != count * values.itemsize:
+        raise EOFError(f"Expected {count} values of type {typecode}")
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def unpack_array_from(buffer, typecode: str, count: int, offset: int = 0) -> array:
+    values = array(typecode)
+    values.frombytes(memoryview(buffer)[offset:offset + count * values.itemsize])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def write_array(file, typecode: str, values: Sequence[int]):
+    file.write(to_array_bytes(typecode, values))
+
+def read_int16_array(file, count: int) -> array:
+    return read_array(file, 'h', count)
+
+def read_int32_array(file, count: int) -> array:
+    return read_array(file, 'i', count)
+
+def read_uint32_array(file, count: int) -> array:
+    return read_array(file, 'I', count)
+
+def write_int16_array(file, values: Sequence[int]):
+    write_array(file, 'h', values)
+
+def write_int32_array(file, values: Sequence[int]):
+    write_array(file, 'i', values)
+
+def write_uint32_array(file, values: Sequence[int]):
+    write_array(file, 'I', values)
 
 class SmartIO:
     int8 = "b"
@@ -67,48 +131,49 @@ class SmartIO:
 
     def __init__(self, format: str):
         self.format = format
-        self.count = struct.calcsize(format)
+        self.struct = struct.Struct(format)
+        self.count = self.struct.size
 
     @classmethod
     def makeFormat(cls, *formats: List[str]) -> SmartIO:
         return SmartIO("<" + "".join(formats))
     
     def read(self, file) -> Tuple[Any]:
-        return struct.unpack(self.format, file.read(self.count))
+        return self.struct.unpack(file.read(self.count))
 
     def write(self, file, values: Any):
-        file.write(struct.pack(self.format, *values))
+        file.write(self.struct.pack(*values))
 
 def to_uint(bs):
 	return int.from_bytes(bs, byteorder='little', signed=False)
 
 def write_char(file, char):
-    entry = struct.pack('<s', bytes(char, 'utf-8'))
+    entry = CHAR.pack(bytes(char, 'utf-8'))
     file.write(entry)
 
 
 def write_Int32(file, int):
-    entry = struct.pack('<i', int)
+    entry = INT32.pack(int)
     file.write(entry)
 
 
 def write_uInt32(file, int):
-    entry = struct.pack('<I', int)
+    entry = UINT32.pack(int)
     file.write(entry)
 
 
 def write_Int16(file, int):
-    entry = struct.pack('<h', int)
+    entry = INT16.pack(int)
     file.write(entry)
 
 
 def write_uInt16(file, int):
-    entry = struct.pack('<H', int)
+    entry = UINT16.pack(int)
     file.write(entry)
 
 
 def write_float(file, float):
-    entry = struct.pack('<f', float)
+    entry = FLOAT.pack(float)
     file.write(entry)
 
 
@@ -118,17 +183,18 @@ def write_xyz(file, xyz):
 
 
 def write_buffer(file, size):
-    for i in range(size):
-        write_char(file, '')
+    # zero fill
+    if size > 0:
+        file.write(bytes(size))
 
 
 def write_byte(file, val):
-    entry = struct.pack('B', val)
+    entry = UINT8.pack(val)
     file.write(entry)
 
 
 def write_float16(file, val):
-    entry = struct.pack("<e", val)
+    entry = FLOAT16.pack(val)
     file.write(entry)
 
 # WMB
@@ -150,13 +216,23 @@ def close_wmb(wmb_file, generated_data):
 def to_string(bs, encoding = 'utf8'):
     return bs.split(b'\x00')[0].decode(encoding)
 
+STRING_CHUNK_SIZE = 64
+
 def read_string(file, maxBen = -1) -> str:
-    binaryString = b""
-    while maxBen == -1 or len(binaryString) > maxBen:
-        char = readBe_char(file)
-        if char == b'\x00':
+    # reads until a null byte (which is skipped) or at most maxBen bytes
+    binaryString = bytearray()
+    while maxBen == -1 or len(binaryString) < maxBen:
+        chunkSize = STRING_CHUNK_SIZE if maxBen == -1 else min(STRING_CHUNK_SIZE, maxBen - len(binaryString))
+        chunk = file.read(chunkSize)
+        if not chunk:
+            break
+        end = chunk.find(b'\x00')
+        if end != -1:
+            binaryString += chunk[:end]
+            # go back to right after the null byte
+            file.seek(end + 1 - len(chunk), 1)
             break
-        binaryString += char
+        binaryString += chunk
     return binaryString.decode('utf-8')
 
 
@@ -168,25 +244,22 @@ def write_string(file, str):
 # Big Endian
 
 def readBe_int16(file) -> int:
-    entry = file.read(2)
-    return struct.unpack('>h', entry)[0]
+    return BE_INT16.unpack(file.read(2))[0]
 
 def readBe_int32(file) -> int:
-    entry = file.read(4)
-    return struct.unpack('>i', entry)[0]
+    return BE_INT32.unpack(file.read(4))[0]
 
 def readBe_char(file) -> str:
-    entry = file.read(1)
-    return struct.unpack('>c', entry)[0]
+    return BE_CHAR.unpack(file.read(1))[0]
 
 def writeBe_char(file, char):
-    entry = struct.pack('>s', bytes(char, 'utf-8'))
+    entry = CHAR.pack(bytes(char, 'utf-8'))
     file.write(entry)
 
 def writeBe_int32(file, int):
-    entry = struct.pack('>i', int)
+    entry = BE_INT32.pack(int)
     file.write(entry)
 
 def writeBe_int16(file, int):
-    entry = struct.pack('>h', int)
+    entry = BE_INT16.pack(int)
     file.write(entry)
\ No newline at end of file
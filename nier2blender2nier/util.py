@@ -1,7 +1,7 @@
 import json
 import os
 from typing import List
-from nier2blender2nier.ioUtils import read_uint32
+from nier2blender2nier.ioUtils import read_uint32_array
 
 def importContentsFileFromFolder(folderPath: str) -> List[str]:
     # search for metadata or json file
@@ -42,11 +42,11 @@ def readFileOrderMetadata(filepath: str) -> List[str]:
         raise Exception("hash_order.metadata is not supported! Please use 'file_order.metadata' instead.")
         
     with open(filepath, "rb") as f:
-        num_files = read_uint32(f)
-        name_length = read_uint32(f)
+        num_files, name_length = read_uint32_array(f, 2)
+        names = f.read(num_files * name_length)
         files = []
         for i in range(num_files):
-            files.append(f.read(name_length).decode("utf-8").strip("\x00"))
+            files.append(names[i * name_length:(i + 1) * name_length].decode("utf-8").strip("\x00"))
         # remove duplicates and sort
         files = list(set(files))
         files.sort(key=getFileSortingKey)
@@ -0,0 +1,144 @@
+import json
+import os
+import pathlib
+from typing import Dict, Iterable, List, Tuple
+
+def getPathKey(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+class PakInfo:
+    """A parsed pakInfo.json"""
+    infoPath: str
+    pakDir: str
+    # the repacked .pak file, next to the extraction folder
+    pakFile: str
+    stamp: Tuple[int, int]
+    # in pakInfo.json order
+    fileNames: List[str]
+    yaxFiles: List[str]
+    xmlFiles: List[str]
+
+    def __init__(self, infoPath: str, stamp: Tuple[int, int], fileNames: List[str] = None):
+        # the file names of a saved registry, otherwise pakInfo.json is read
+        self.infoPath = infoPath
+        self.pakDir = os.path.dirname(infoPath)
+        pakFileName = pathlib.Path(self.pakDir).parts[-1]
+        self.pakFile = str(pathlib.Path(self.pakDir).parent.parent / pakFileName)
+        self.stamp = stamp
+        if fileNames is None:
+            with open(infoPath, "r") as f:
+                pakInfo = json.load(f)
+            fileNames = [file["name"] for file in pakInfo["files"]]
+        self.fileNames = fileNames
+        self.yaxFiles = [os.path.join(self.pakDir, name) for name in fileNames]
+        self.xmlFiles = [os.path.join(self.pakDir, name.replace(".yax", ".xml")) for name in fileNames]
+
+class PakRegistry:
+    """
+    All pakInfo.json files below a folder, parsed once. Lookups from xml/yax files
+    to their pak are dict lookups. A pakInfo.json is only parsed again when it changed.
+    """
+    folder: str
+    # pakInfo.json path key -> pak, in discovery order
+    paks: Dict[str, PakInfo]
+    # xml/yax path key -> pak
+    pakByXml: Dict[str, PakInfo]
+    pakByYax: Dict[str, PakInfo]
+
+    def __init__(self, folder: str, state: dict = None, infoPaths: Iterable[str] = None):
+        # with the state of a previous run only new and changed pakInfo.json files are parsed
+        self.folder = folder
+        self.paks = {}
+        self.pakByXml = {}
+        self.pakByYax = {}
+        if state is not None:
+            self.setState(state)
+        self.scan(infoPaths)
+
+    def getState(self) -> dict:
+        # json data
+        return { "paks": [
+            { "infoPath": pak.infoPath, "stamp": list(pak.stamp), "files": pak.fileNames }
+            for pak in self.paks.values()
+        ] }
+
+    def setState(self, state: dict) -> None:
+        self.paks = {}
+        self.pakByXml = {}
+        self.pakByYax = {}
+        for pak in state["paks"]:
+            self.add(PakInfo(pak["infoPath"], tuple(pak["stamp"]), pak["files"]))
+
+    def scan(self, infoPaths: Iterable[str] = None) -> None:
+        # adds new, parses changed and removes deleted pakInfo.json files
+        # without known infoPaths the folder is walked
+        if infoPaths is None:
+            infoPaths = [
+                os.path.join(root, "pakInfo.json")
+                for root, dirs, filenames in os.walk(self.folder)
+                if "pakInfo.json" in filenames
+            ]
+        foundKeys = set()
+        for infoPath in infoPaths:
+            foundKeys.add(getPathKey(infoPath))
+            self.refresh(infoPath)
+        for key in self.paks.keys() - foundKeys:
+            self.remove(key)
+
+    def refresh(self, infoPath: str) -> PakInfo:
+        """Parses a new or changed pakInfo.json and removes deleted ones. Returns the current pak."""
+        key = getPathKey(infoPath)
+        pak = self.paks.get(key)
+        try:
+            stat = os.stat(infoPath)
+        except FileNotFoundError:
+            if pak is not None:
+                self.remove(key)
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if pak is not None and pak.stamp == stamp:
+            return pak
+
+        try:
+            newPak = PakInfo(infoPath, stamp)
+        except (OSError, ValueError, KeyError):
+            print(f"Invalid {infoPath}")
+            if pak is not None:
+                self.remove(key)
+            return None
+        if pak is not None:
+            self.removeFiles(pak)
+        self.add(newPak)
+        return newPak
+
+    def add(self, pak: PakInfo) -> None:
+        self.paks[getPathKey(pak.infoPath)] = pak
+        for xmlFile in pak.xmlFiles:
+            self.pakByXml[getPathKey(xmlFile)] = pak
+        for yaxFile in pak.yaxFiles:
+            self.pakByYax[getPathKey(yaxFile)] = pak
+
+    def remove(self, key: str) -> None:
+        self.removeFiles(self.paks.pop(key))
+
+    def removeFiles(self, pak: PakInfo) -> None:
+        for xmlFile in pak.xmlFiles:
+            self.pakByXml.pop(getPathKey(xmlFile), None)
+        for yaxFile in pak.yaxFiles:
+            self.pakByYax.pop(getPathKey(yaxFile), None)
+
+    def getPak(self, pakDir: str) -> PakInfo:
+        return self.refresh(os.path.join(pakDir, "pakInfo.json"))
+
+    def findPakOfXml(self, xmlFile: str) -> PakInfo:
+        # the sibling pakInfo.json might have changed without an event
+        self.getPak(os.path.dirname(xmlFile))
+        return self.pakByXml.get(getPathKey(xmlFile))
+
+    def findPakOfYax(self, yaxFile: str) -> PakInfo:
+        self.getPak(os.path.dirname(yaxFile))
+        return self.pakByYax.get(getPathKey(yaxFile))
+
+    @property
+    def xmlFiles(self) -> List[str]:
+        return [xmlFile for pak in self.paks.values() for xmlFile in pak.xmlFiles]
@@ -1,173 +1,713 @@
 import os
-from typing import Dict, List, Tuple
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Set, Tuple
 import xml.etree.ElementTree as ET
-import zlib
-import json
+import itertools
+
+from diagnostics import CheckResult, Diagnostic, printDiagnostics
+from nier2blender2nier.hashing import ACTION_CODE_HASH, ENTITY_CODE_HASH, ReverseHashIndex, crc32
+from pakRegistry import PakRegistry
 
 # UTILS
 
-def printWarning(text: str) -> None:
-	# orange text
-	print(f"\033[33m{currentFile}:\tWARNING: {text}\033[0m")
+def getDisplayName(file: str) -> str:
+	# <pak folder>/<xml name>, since xml names repeat between paks
+	return os.path.join(os.path.basename(os.path.dirname(file)), os.path.basename(file))
 
-def getId(elem: ET.Element, idTag = "id") -> int:
+def getFileStamp(file: str) -> Tuple[int, int]:
+	# (mtime, size) or None if the file doesn't exist
 	try:
-		return int(elem.find(idTag).text, 16)
-	except:
-		return -1
+		stat = os.stat(file)
+	except FileNotFoundError:
+		return None
+	return (stat.st_mtime_ns, stat.st_size)
+
+IdKey = Tuple[str, int]
+# category of the keys of known hash strings
+HASH_STRINGS = "hash strings"
+
+class PakXmlSummary:
+	"""Everything the checks need from one pak xml, so that it only has to be parsed again when it changes"""
+	__slots__ = ("stamp", "idDefinitions", "groupRef", "groupRefPath", "idReferences", "hashStrings", "hashMismatches", "localDiagnostics")
+	stamp: Tuple[int, int]
+	# (category, element path, id)
+	idDefinitions: List[Tuple[str, str, int]]
+	# referenced file group, -1 if none
+	groupRef: int
+	groupRefPath: str
+	# (category, code, id, element path)
+	idReferences: List[Tuple[str, int, int, str]]
+	# all str="..." attributes
+	hashStrings: Set[str]
+	# (element path, hash text, hash, str) of elements whose hash doesn't match their str
+	hashMismatches: List[Tuple[str, str, int, str]]
+	# diagnostics that only depend on this file (sizes, hashes)
+	localDiagnostics: List[Diagnostic]
+
+	def __init__(self, stamp: Tuple[int, int]):
+		self.stamp = stamp
+		self.idDefinitions = []
+		self.groupRef = -1
+		self.groupRefPath = ""
+		self.idReferences = []
+		self.hashStrings = set()
+		self.hashMismatches = []
+		self.localDiagnostics = []
+
+	@property
+	def isMissing(self) -> bool:
+		return self.stamp is None
+
+	def definedKeys(self) -> Set[IdKey]:
+		return { (category, id) for category, _, id in self.idDefinitions }
+
+	def referencedKeys(self) -> Set[IdKey]:
+		keys = { (category, id) for category, _, id, _ in self.idReferences }
+		if self.groupRef != -1:
+			keys.add(("groups", self.groupRef))
+		# mismatches suggest the known string of their hash
+		keys.update((HASH_STRINGS, hash) for _, _, hash, _ in self.hashMismatches)
+		return keys
+
+	def hashStringKeys(self) -> Set[IdKey]:
+		return { (HASH_STRINGS, crc32(text)) for text in self.hashStrings }
+
+	def getState(self) -> dict:
+		# json data
+		return {
+			"stamp": list(self.stamp) if self.stamp is not None else None,
+			"idDefinitions": self.idDefinitions,
+			"groupRef": self.groupRef,
+			"groupRefPath": self.groupRefPath,
+			"idReferences": self.idReferences,
+			"hashStrings": sorted(self.hashStrings),
+			"hashMismatches": self.hashMismatches,
+			"localDiagnostics": [diagnostic.getState() for diagnostic in self.localDiagnostics],
+		}
+
+	def setState(self, state: dict) -> None:
+		# element paths are interned like when they are parsed
+		self.stamp = tuple(state["stamp"]) if state["stamp"] is not None else None
+		self.idDefinitions = [(category, sys.intern(path), id) for category, path, id in state["idDefinitions"]]
+		self.groupRef = state["groupRef"]
+		self.groupRefPath = sys.intern(state["groupRefPath"])
+		self.idReferences = [(category, code, id, sys.intern(path)) for category, code, id, path in state["idReferences"]]
+		self.hashStrings = set(state["hashStrings"])
+		self.hashMismatches = [(sys.intern(path), text, hash, hashStr) for path, text, hash, hashStr in state["hashMismatches"]]
+		self.localDiagnostics = [Diagnostic(*diagnostic) for diagnostic in state["localDiagnostics"]]
+
+class IdDefinitionSite:
+	__slots__ = ("file", "tag", "count")
+	file: str
+	tag: str
+	# number of definitions of the same id in this file
+	count: int
+
+	def __init__(self, file: str, tag: str):
+		self.file = file
+		self.tag = tag
+		self.count = 0
 
-def crc32(text: str) -> int:
-	return zlib.crc32(text.encode('ascii')) & 0xFFFFFFFF
+	def describe(self) -> str:
+		return f"{getDisplayName(self.file)} (<{self.tag}>)"
+
+class IdIndex:
+	"""All defined IDs, as hash sets per category and with the sites that define them"""
+	categories: Dict[str, Set[int]]
+	sites: Dict[IdKey, Dict[str, IdDefinitionSite]]
+
+	def __init__(self):
+		self.categories = {}
+		self.sites = {}
+
+	def add(self, file: str, category: str, tag: str, id: int) -> None:
+		self.categories.setdefault(category, set()).add(id)
+		sites = self.sites.setdefault((category, id), {})
+		site = sites.get(file)
+		if site is None:
+			site = IdDefinitionSite(file, tag)
+			sites[file] = site
+		site.count += 1
+
+	def remove(self, file: str, category: str, id: int) -> None:
+		key = (category, id)
+		sites = self.sites[key]
+		sites[file].count -= 1
+		if sites[file].count > 0:
+			return
+		del sites[file]
+		if not sites:
+			del self.sites[key]
+			self.categories[category].discard(id)
+
+	def contains(self, category: str, id: int) -> bool:
+		return id in self.categories.get(category, ())
+
+	def definingFiles(self, key: IdKey) -> Iterable[str]:
+		return self.sites.get(key, {}).keys()
+
+	def firstSite(self, key: IdKey, fileIndices: Dict[str, int]) -> IdDefinitionSite:
+		sites = self.sites[key]
+		return sites[min(sites.keys(), key=fileIndices.__getitem__)]
 
 # MAIN
 
-currentFile: str = ""
-def checkWarningsInFolder(folder: str) -> None:
-	global currentFile
-	allIds: Dict[str, List[int]] = {
-		"groups": [],
-		"actions": [],
-		"entities": [],
-		"script variable": [],
-	}
-
-	xmlDocs: Tuple[str, List[ET.Element]] = []
-	for file in findAllPakXmlFiles(folder):
-		xmlName = os.path.basename(file)
-		if not os.path.isfile(file):
-			printWarning(f"{xmlName} is missing")
-			continue
+class WarningsChecker:
+	"""
+	Keeps the summaries of all pak xml files between runs.
+	Only changed files are parsed again and only cross file checks
+	that depend on changed IDs are evaluated again.
+	"""
+	summaries: Dict[str, PakXmlSummary]
+	fileOrder: List[str]
+	idIndex: IdIndex
+	# id -> files that reference it
+	idReferenceSites: Dict[IdKey, Set[str]]
+	# per file cross file diagnostics (duplicate IDs, unknown IDs)
+	definitionDiagnostics: Dict[str, List[Diagnostic]]
+	usageDiagnostics: Dict[str, List[Diagnostic]]
+	# all diagnostics of the last check
+	diagnostics: List[Diagnostic]
+	hashIndex: ReverseHashIndex
+	# files are parsed in a process pool if workers > 1
+	workers: int
+	pool: ProcessPoolExecutor
+	# a pool that is shared with other checkers isn't shut down by close()
+	ownsPool: bool
+	# parse with iterparse and keep only the open elements in memory
+	streaming: bool
+
+	def __init__(self, workers: int = 1, streaming: bool = False, pool: ProcessPoolExecutor = None):
+		self.summaries = {}
+		self.fileOrder = []
+		self.idIndex = IdIndex()
+		self.idReferenceSites = {}
+		self.definitionDiagnostics = {}
+		self.usageDiagnostics = {}
+		self.diagnostics = []
+		self.hashIndex = ReverseHashIndex()
+		self.workers = workers
+		self.pool = pool
+		self.ownsPool = pool is None
+		self.streaming = streaming
+
+	def getState(self) -> dict:
+		"""The summaries and diagnostics as json data, the indices are rebuilt from the summaries"""
+		def getDiagnosticStates(diagnosticsByFile: Dict[str, List[Diagnostic]]) -> Dict[str, list]:
+			return { file: [diagnostic.getState() for diagnostic in diagnostics] for file, diagnostics in diagnosticsByFile.items() }
+		return {
+			"summaries": { file: summary.getState() for file, summary in self.summaries.items() },
+			"fileOrder": self.fileOrder,
+			"definitionDiagnostics": getDiagnosticStates(self.definitionDiagnostics),
+			"usageDiagnostics": getDiagnosticStates(self.usageDiagnostics),
+		}
+
+	def setState(self, state: dict) -> None:
+		def getDiagnostics(diagnosticStates: Dict[str, list]) -> Dict[str, List[Diagnostic]]:
+			return { file: [Diagnostic(*diagnostic) for diagnostic in diagnostics] for file, diagnostics in diagnosticStates.items() }
+		self.summaries = {}
+		self.idIndex = IdIndex()
+		self.idReferenceSites = {}
+		self.hashIndex = ReverseHashIndex()
+		for file, summaryState in state["summaries"].items():
+			summary = PakXmlSummary(None)
+			summary.setState(summaryState)
+			self.replaceSummary(file, None, summary)
+		self.fileOrder = state["fileOrder"]
+		self.definitionDiagnostics = getDiagnostics(state["definitionDiagnostics"])
+		self.usageDiagnostics = getDiagnostics(state["usageDiagnostics"])
+		self.diagnostics = self.collectDiagnostics(self.fileOrder)
+
+	def setWorkers(self, workers: int) -> None:
+		if workers == self.workers:
+			return
+		self.close()
+		self.workers = workers
+
+	def close(self) -> None:
+		if self.pool is not None and self.ownsPool:
+			self.pool.shutdown()
+			self.pool = None
+
+	def check(self, folder: str, xmlFiles: List[str] = None) -> CheckResult:
+		"""Collects the diagnostics of all files and compares them to the previous check"""
+		files = xmlFiles if xmlFiles is not None else findAllPakXmlFiles(folder)
+		changedFiles, changedKeys = self.updateSummaries(files)
+		parsedFiles = list(changedFiles)
+
+		if files != self.fileOrder:
+			# which definition counts as the first one depends on the file order
+			self.fileOrder = files
+			dirtyFiles = set(files)
+		else:
+			dirtyFiles = changedFiles
+			for key in changedKeys:
+				dirtyFiles.update(self.idIndex.definingFiles(key))
+				dirtyFiles.update(self.idReferenceSites.get(key, ()))
+
+		fileIndices = { file: i for i, file in enumerate(self.fileOrder) }
+		for file in dirtyFiles:
+			self.definitionDiagnostics[file] = self.findDefinitionDiagnostics(file, fileIndices)
+		for file in dirtyFiles:
+			self.usageDiagnostics[file] = self.findUsageDiagnostics(file)
+
+		diagnostics = self.collectDiagnostics(files)
+		result = CheckResult(diagnostics, self.diagnostics, parsedFiles)
+		self.diagnostics = diagnostics
+		return result
+
+	def collectDiagnostics(self, files: List[str]) -> List[Diagnostic]:
+		# definitions of all files first, then usages and local checks
+		diagnostics: List[Diagnostic] = []
+		for file in files:
+			diagnostics.extend(self.definitionDiagnostics[file])
+		for file in files:
+			diagnostics.extend(self.usageDiagnostics[file])
+			diagnostics.extend(self.summaries[file].localDiagnostics)
+		return diagnostics
+
+	def updateSummaries(self, files: List[str]) -> Tuple[Set[str], Set[IdKey]]:
+		changedFiles: Set[str] = set()
+		changedKeys: Set[IdKey] = set()
+
+		outdatedFiles: List[str] = []
+		missingFiles: List[str] = []
+		for file in files:
+			stamp = getFileStamp(file)
+			oldSummary = self.summaries.get(file)
+			if oldSummary is not None and oldSummary.stamp == stamp:
+				continue
+			if stamp is None:
+				missingFiles.append(file)
+			else:
+				outdatedFiles.append(file)
+
+		newSummaries = zip(outdatedFiles, self.summarizeFiles(outdatedFiles))
+		missingSummaries = ((file, PakXmlSummary(None)) for file in missingFiles)
+		for file, summary in itertools.chain(newSummaries, missingSummaries):
+			changedFiles.add(file)
+			changedKeys.update(self.replaceSummary(file, self.summaries.get(file), summary))
+
+		removedFiles = self.summaries.keys() - set(files)
+		for file in removedFiles:
+			changedKeys.update(self.replaceSummary(file, self.summaries[file], None))
+			self.definitionDiagnostics.pop(file, None)
+			self.usageDiagnostics.pop(file, None)
+
+		return changedFiles, changedKeys
+
+	def summarizeFiles(self, files: List[str]) -> List[PakXmlSummary]:
+		# small batches aren't worth the overhead of sending them to other processes
+		if self.workers <= 1 or len(files) < minParallelFiles:
+			return [summarizePakXml(file, self.streaming) for file in files]
+		if self.pool is None:
+			self.pool = ProcessPoolExecutor(max_workers=self.workers)
+		chunkSize = max(1, len(files) // (self.workers * 4))
+		streamingArgs = itertools.repeat(self.streaming, len(files))
+		return list(self.pool.map(summarizePakXml, files, streamingArgs, chunksize=chunkSize))
+
+	def replaceSummary(self, file: str, oldSummary: PakXmlSummary, newSummary: PakXmlSummary) -> Set[IdKey]:
+		oldDefinitions = oldSummary.definedKeys() | oldSummary.hashStringKeys() if oldSummary is not None else set()
+		newDefinitions = newSummary.definedKeys() | newSummary.hashStringKeys() if newSummary is not None else set()
+
+		if oldSummary is not None:
+			for category, _, id in oldSummary.idDefinitions:
+				self.idIndex.remove(file, category, id)
+			for text in oldSummary.hashStrings:
+				self.hashIndex.remove(text)
+			for key in oldSummary.referencedKeys():
+				sites = self.idReferenceSites[key]
+				sites.discard(file)
+				if not sites:
+					del self.idReferenceSites[key]
+
+		if newSummary is not None:
+			for category, path, id in newSummary.idDefinitions:
+				self.idIndex.add(file, category, getPathTag(path), id)
+			for text in newSummary.hashStrings:
+				self.hashIndex.add(text)
+			for key in newSummary.referencedKeys():
+				self.idReferenceSites.setdefault(key, set()).add(file)
+			self.summaries[file] = newSummary
+		else:
+			del self.summaries[file]
+
+		# changed definitions affect duplicate checks of other definers and all references
+		# a file with the same IDs but different definition counts only affects itself
+		return oldDefinitions ^ newDefinitions
+
+	def findDefinitionDiagnostics(self, file: str, fileIndices: Dict[str, int]) -> List[Diagnostic]:
+		summary = self.summaries[file]
+		if summary.isMissing:
+			return [Diagnostic(file, "", "missing-file", f"{os.path.basename(file)} is missing")]
+
+		diagnostics = []
+		seenInFile: Set[IdKey] = set()
+		for category, path, id in summary.idDefinitions:
+			tag = getPathTag(path)
+			if id < 0 or id > 0xFFFFFFFF:
+				diagnostics.append(Diagnostic(file, path, "id-out-of-range", f"{category} (<{tag}>) id 0x{id:x} is out of range"))
+			key = (category, id)
+			firstSite = self.idIndex.firstSite(key, fileIndices)
+			if firstSite.file != file or key in seenInFile:
+				diagnostics.append(Diagnostic(
+					file, path, "duplicate-id",
+					f"Duplicate {category} (<{tag}>) id 0x{id:x} in {getDisplayName(file)}, first defined in {firstSite.describe()}"
+				))
+			seenInFile.add(key)
+		return diagnostics
+
+	def findUsageDiagnostics(self, file: str) -> List[Diagnostic]:
+		summary = self.summaries[file]
+		diagnostics = []
+		if summary.groupRef != -1 and not self.idIndex.contains("groups", summary.groupRef):
+			diagnostics.append(Diagnostic(file, summary.groupRefPath, "unknown-group", f"Group id 0x{summary.groupRef:x} references unknown group"))
+		for category, codeId, valueId, path in summary.idReferences:
+			if self.idIndex.contains(category, valueId):
+				continue
+			if category == "actions":
+				diagnostics.append(Diagnostic(file, path, "unknown-action", f"Action code 0x{codeId:x} references unknown action 0x{valueId:x}"))
+			else:
+				diagnostics.append(Diagnostic(file, path, "unknown-entity", f"Entity code 0x{codeId:x} references unknown entity 0x{valueId:x}"))
+		for path, hashText, hash, hashStr in summary.hashMismatches:
+			message = f"<{getPathTag(path)}> hash mismatch ({hashText} != crc32(\"{hashStr}\")=0x{crc32(hashStr):x})"
+			knownStrings = self.hashIndex.find(hash)
+			if knownStrings:
+				message += f", {hashText} is crc32(\"{knownStrings[0]}\")"
+			diagnostics.append(Diagnostic(file, path, "hash-mismatch", message))
+		return diagnostics
 
-		currentFile = xmlName
-		xmlDoc = ET.parse(file).getroot()
-		xmlDocs.append((xmlName, xmlDoc))
+minParallelFiles = 8
 
-		collectIds(xmlDoc, allIds)
-	
-	for file, xmlDoc in xmlDocs:
-		currentFile = file
-		verifyIdUsages(xmlDoc, allIds)
-		verifySizes(xmlDoc)
-		verifyHashes(xmlDoc)
+defaultChecker = WarningsChecker()
+
+def checkWarningsInFolder(folder: str, workers: int = 1, streaming: bool = False, xmlFiles: List[str] = None) -> CheckResult:
+	# prints all warnings
+	defaultChecker.setWorkers(workers)
+	defaultChecker.streaming = streaming
+	result = defaultChecker.check(folder, xmlFiles)
+	printDiagnostics(result.diagnostics)
+	return result
+
+def summarizePakXml(file: str, streaming: bool = False) -> PakXmlSummary:
+	summary = PakXmlSummary(getFileStamp(file))
+	context = CheckContext(file, summary)
+	if streaming:
+		visitPakXmlStreaming(file, context)
+	else:
+		visitPakXml(ET.parse(file).getroot(), context)
+	return summary
 
 def findAllPakXmlFiles(folder: str) -> List[str]:
 	# find all pakInfo.json and find their xml files
-	pakInfos: List[str] = []
-	xmlFiles: List[str] = []
-	for root, dirs, filenames in os.walk(folder):
-		for filename in filenames:
-			if filename != "pakInfo.json":
-				continue
-			pakInfos.append(os.path.join(root, filename))
-
-	for pakInfoPath in pakInfos:
-		with open(pakInfoPath, "r") as f:
-			pakInfo = json.load(f)
-		for file in pakInfo["files"]:
-			xmlName = file["name"].replace(".yax", ".xml")
-			pakInfoFolder = os.path.dirname(pakInfoPath)
-			xmlFiles.append(os.path.join(pakInfoFolder, xmlName))
-			
-	return xmlFiles
+	return PakRegistry(folder).xmlFiles
 
-# CHECKS
+# VISITOR
+
+class VisitedElement:
+	# only valid while a rule runs, leaves share one instance
+	__slots__ = ("elem", "childCount", "children", "ancestors")
+	elem: ET.Element
+	childCount: int
+	# first child (and its index) of every tag that a rule is interested in
+	children: Dict[str, Tuple[int, ET.Element]]
+	# tags from the root to the parent
+	ancestors: List[str]
+
+	def __init__(self, elem: ET.Element, childCount: int, children: Dict[str, Tuple[int, ET.Element]], ancestors: List[str]):
+		self.elem = elem
+		self.childCount = childCount
+		self.children = children
+		self.ancestors = ancestors
+
+	def child(self, tag: str) -> ET.Element:
+		found = self.children.get(tag)
+		return found[1] if found is not None else None
+
+	def childIndex(self, tag: str) -> int:
+		return self.children[tag][0]
+
+	def childId(self, tag: str) -> int:
+		try:
+			return int(self.children[tag][1].text, 16)
+		except:
+			return -1
+
+	def path(self, childTag: str = None) -> str:
+		# tags from the root to this element (or one of its children)
+		tags = self.ancestors + [self.elem.tag]
+		if childTag is not None:
+			tags.append(childTag)
+		return sys.intern("/".join(tags))
+
+def getPathTag(path: str) -> str:
+	return path[path.rfind("/") + 1:]
+
+class CheckContext:
+	file: str
+	xmlName: str
+	summary: PakXmlSummary
 
-def collectIds(xmlDoc: ET.Element, allIds: Dict[str, List[int]]) -> None:
-	def handleId(category: str, elem: ET.Element):
-		id = getId(elem)
-		if id < 0 or id > 0xFFFFFFFF:
-			printWarning(f"{category} (<{elem.tag}>) id 0x{id:x} is out of range")
-		if category in allIds and id in allIds[category]:
-			printWarning(f"Duplicate {category} (<{elem.tag}>) id 0x{id:x}")
+	def __init__(self, file: str, summary: PakXmlSummary):
+		self.file = file
+		self.xmlName = os.path.basename(file)
+		self.summary = summary
+
+	def addDiagnostic(self, visited: VisitedElement, rule: str, message: str) -> None:
+		self.summary.localDiagnostics.append(Diagnostic(self.file, visited.path(), rule, message))
+
+CheckRule = Callable[[VisitedElement, CheckContext], None]
+
+rootRules: List[CheckRule] = []
+tagRules: Dict[str, List[CheckRule]] = {}
+childRules: List[Tuple[CheckRule, Set[str]]] = []
+attributeRules: Dict[str, List[CheckRule]] = {}
+watchedChildTags: Set[str] = set()
+# children that trigger a child rule
+triggerChildTags: Set[str] = set()
+
+# what the visitors have to do for an element of a tag: (tag rules, is a watched child, triggers a child rule)
+TagPlan = Tuple[List[CheckRule], bool, bool]
+tagPlans: Dict[str, TagPlan] = {}
+noChildren: Dict[str, Tuple[int, ET.Element]] = {}
+
+def getTagPlan(tag: str) -> TagPlan:
+	plan = tagPlans.get(tag)
+	if plan is None:
+		plan = (tagRules.get(tag), tag in watchedChildTags, tag in triggerChildTags)
+		tagPlans[tag] = plan
+	return plan
+
+def checkRule(root: bool = False, tag: str = None, withChild: Iterable[str] = (), withAttribute: str = None, childTags: Iterable[str] = ()):
+	"""
+	Registers a check that is called during the single pass over a pak xml.
+	It runs for the root element, for every <tag> element, for elements that
+	have one of the withChild children or for elements with the withAttribute attribute.
+	childTags are additional children that the check looks up with VisitedElement.child()
+
+	Checks run after all children of an element have been visited. They may only use
+	the element's text and attributes, the watched children and the ancestor tags,
+	since everything deeper is already discarded in streaming mode.
+	"""
+	def decorator(rule: CheckRule) -> CheckRule:
+		if root:
+			rootRules.append(rule)
+		elif tag is not None:
+			tagRules.setdefault(tag, []).append(rule)
+		elif withChild:
+			childRules.append((rule, set(withChild)))
+		elif withAttribute is not None:
+			attributeRules.setdefault(withAttribute, []).append(rule)
 		else:
-			if category not in allIds:
-				allIds[category] = []
-			allIds[category].append(id)
+			raise ValueError(f"Check {rule.__name__} has no trigger")
+		watchedChildTags.update(withChild)
+		watchedChildTags.update(childTags)
+		triggerChildTags.update(withChild)
+		tagPlans.clear()
+		return rule
+	return decorator
 
-	# file ID
-	fileId = getId(xmlDoc)
-	if fileId != -1:
-		handleId("files", xmlDoc)
+def runRules(
+	elem: ET.Element, childCount: int, children: Dict[str, Tuple[int, ET.Element]], ancestors: List[str],
+	context: CheckContext, tagRuleList: List[CheckRule], hasTriggerChild: bool
+) -> None:
+	# the visitors only call it if a rule might run, the VisitedElement is only created if one does
+	visited = None
+	if not ancestors:
+		visited = VisitedElement(elem, childCount, children, ancestors)
+		for rule in rootRules:
+			rule(visited, context)
+	if hasTriggerChild:
+		for rule, triggerTags in childRules:
+			if triggerTags.isdisjoint(children):
+				continue
+			if visited is None:
+				visited = VisitedElement(elem, childCount, children, ancestors)
+			rule(visited, context)
+	if tagRuleList is not None:
+		if visited is None:
+			visited = VisitedElement(elem, childCount, children, ancestors)
+		for rule in tagRuleList:
+			rule(visited, context)
+	attributes = elem.attrib
+	if attributes:
+		for attribute in attributes:
+			attributeRuleList = attributeRules.get(attribute)
+			if attributeRuleList is None:
+				continue
+			if visited is None:
+				visited = VisitedElement(elem, childCount, children, ancestors)
+			for rule in attributeRuleList:
+				rule(visited, context)
 
-	# actions
-	for action in xmlDoc.findall("action"):
-		handleId("actions", action)
+def visitPakXml(xmlDoc: ET.Element, context: CheckContext) -> None:
+	ancestors: List[str] = []
+	# bound once, the loop below runs for every element
+	getPlan = tagPlans.get
+	attributeRuleItems = list(attributeRules.items())
+	# leaves with attributes (str="...") are most elements, they share one VisitedElement
+	leaf = VisitedElement(None, 0, noChildren, ancestors)
 
-	# groups (0.xml)
-	if currentFile == "0.xml":
-		for group in xmlDoc.findall("group"):
-			handleId("groups", group)
-	
-	# entities
-	for layouts in xmlDoc.findall(".//layouts"):
-		normal = layouts.find("normal")
-		if normal is None:
+	def visit(elem: ET.Element, tag: str, tagRuleList: List[CheckRule]) -> None:
+		# children are visited first and scanned only once for all rules
+		children = noChildren
+		hasTriggerChild = False
+		ancestors.append(tag)
+		for i, child in enumerate(elem):
+			childTag = child.tag
+			childPlan = getPlan(childTag) or getTagPlan(childTag)
+			if len(child):
+				visit(child, childTag, childPlan[0])
+			elif childPlan[0] is not None:
+				runRules(child, 0, noChildren, ancestors, context, childPlan[0], False)
+			else:
+				for attribute, attributeRuleList in attributeRuleItems:
+					if child.get(attribute) is not None:
+						leaf.elem = child
+						for rule in attributeRuleList:
+							rule(leaf, context)
+			if childPlan[1]:
+				if children is noChildren:
+					children = {}
+				if childTag not in children:
+					children[childTag] = (i, child)
+				hasTriggerChild = hasTriggerChild or childPlan[2]
+		ancestors.pop()
+		if hasTriggerChild or tagRuleList is not None or elem.attrib or not ancestors:
+			runRules(elem, len(elem), children, ancestors, context, tagRuleList, hasTriggerChild)
+
+	rootTag = xmlDoc.tag
+	if len(xmlDoc):
+		visit(xmlDoc, rootTag, getTagPlan(rootTag)[0])
+	else:
+		runRules(xmlDoc, 0, noChildren, ancestors, context, getTagPlan(rootTag)[0], False)
+
+class OpenElement:
+	__slots__ = ("elem", "childCount", "children", "hasTriggerChild")
+	elem: ET.Element
+	childCount: int
+	children: Dict[str, Tuple[int, ET.Element]]
+	hasTriggerChild: bool
+
+	def __init__(self, elem: ET.Element):
+		self.elem = elem
+		self.childCount = 0
+		self.children = {}
+		self.hasTriggerChild = False
+
+def visitPakXmlStreaming(file: str, context: CheckContext) -> None:
+	"""
+	Same as visitPakXml, but on top of ET.iterparse. Elements are discarded as soon as
+	their checks have run, only the open elements and their watched children are kept.
+	"""
+	openElements: List[OpenElement] = []
+	ancestors: List[str] = []
+	for event, elem in ET.iterparse(file, events=("start", "end")):
+		if event == "start":
+			openElements.append(OpenElement(elem))
+			ancestors.append(elem.tag)
 			continue
-		layouts = normal.find("layouts")
-		if layouts is None:
+
+		current = openElements.pop()
+		ancestors.pop()
+		plan = getTagPlan(elem.tag)
+		if current.hasTriggerChild or plan[0] is not None or elem.attrib or not ancestors:
+			runRules(elem, current.childCount, current.children, ancestors, context, plan[0], current.hasTriggerChild)
+		# the parent's checks only need the text of its direct children
+		del elem[:]
+
+		if not openElements:
 			continue
-		for value in layouts.findall("value"):
-			handleId("entities", value)
-		
-	# script ids
-	for scriptVars in xmlDoc.findall(".//variables"):
-		for value in scriptVars.findall("value"):
-			handleId("script variable", value)
-
-def verifyIdUsages(xmlDoc: ET.Element, allIds: Dict[str, List[int]]) -> None:
-	actionHash = crc32("hap::Action")
-	entityHash = crc32("app::EntityLayout")
+		parent = openElements[-1]
+		if plan[1] and elem.tag not in parent.children:
+			parent.children[elem.tag] = (parent.childCount, elem)
+			parent.hasTriggerChild = parent.hasTriggerChild or plan[2]
+		parent.childCount += 1
+		parent.elem.remove(elem)
+
+# CHECKS
+
+def addIdDefinition(context: CheckContext, category: str, visited: VisitedElement, id: int) -> None:
+	context.summary.idDefinitions.append((category, visited.path(), id))
+
+@checkRule(root=True, childTags=("id", "group"))
+def collectFileIds(visited: VisitedElement, context: CheckContext) -> None:
+	# file ID
+	fileId = visited.childId("id")
+	if fileId != -1:
+		addIdDefinition(context, "files", visited, fileId)
 
 	# file group id
-	fileGroup = xmlDoc.find("group")
+	fileGroup = visited.child("group")
 	if fileGroup is not None and fileGroup.text.startswith("0x"):
-		fileGroupId = int(fileGroup.text, 16)
-		if fileGroupId not in allIds["groups"]:
-			printWarning(f"Group id 0x{fileGroupId:x} references unknown group")
-
-	for elem in xmlDoc.iter():
-		code = elem.find("code")
-		value = elem.find("value")
-		id = elem.find("id")
-		if code is None or (value is None and id is None):
-			continue
-		codeId = getId(elem, "code")
-		valueId = getId(elem, "value") if value is not None else getId(elem, "id")
-		if valueId == 0 or valueId == -1:
-			continue
-		if codeId == actionHash:
-			if valueId not in allIds["actions"]:
-				printWarning(f"Action code 0x{codeId:x} references unknown action 0x{valueId:x}")
-		elif codeId == entityHash:
-			if valueId not in allIds["entities"]:
-				printWarning(f"Entity code 0x{codeId:x} references unknown entity 0x{valueId:x}")
-
-
-def verifySizes(xmlDoc: ET.Element) -> None:
-	def verifySizeFor(parent: ET.Element, sizeElemI: int, size: int):
-		trueSize = len(parent) - sizeElemI - 1
-		if trueSize != size:
-			printWarning(f"<{parent.tag}> has {trueSize} elements instead of {size}")
-
-	for elem in xmlDoc.iter():
-		sizeElem = elem.find("size")
-		countElem = elem.find("count")
-		if sizeElem is not None:
-			verifySizeFor(
-				elem,
-				list(elem).index(sizeElem),
-				int(sizeElem.text)
-			)
-		elif countElem is not None and countElem.text.startswith("0x"):
-			verifySizeFor(
-				elem,
-				list(elem).index(countElem),
-				int(countElem.text, 16)
-			)
-
-def verifyHashes(xmlDoc: ET.Element) -> None:
-	for elem in xmlDoc.iter():
-		if "str" in elem.attrib:
-			if crc32(elem.attrib["str"]) == int(elem.text, 16):
-				continue
-			printWarning(f"<{elem.tag}> hash mismatch ({elem.text} != crc32(\"{elem.attrib['str']}\")=0x{crc32(elem.attrib['str']):x})")
+		context.summary.groupRef = int(fileGroup.text, 16)
+		context.summary.groupRefPath = visited.path("group")
+
+@checkRule(tag="action", childTags=("id",))
+def collectActionIds(visited: VisitedElement, context: CheckContext) -> None:
+	if len(visited.ancestors) == 1:
+		addIdDefinition(context, "actions", visited, visited.childId("id"))
+
+@checkRule(tag="group", childTags=("id",))
+def collectGroupIds(visited: VisitedElement, context: CheckContext) -> None:
+	# groups (0.xml)
+	if len(visited.ancestors) == 1 and context.xmlName == "0.xml":
+		addIdDefinition(context, "groups", visited, visited.childId("id"))
+
+@checkRule(tag="value", childTags=("id",))
+def collectValueIds(visited: VisitedElement, context: CheckContext) -> None:
+	ancestors = visited.ancestors
+	depth = len(ancestors)
+	# entities (.../layouts/normal/layouts/value)
+	if depth > 3 and ancestors[-1] == "layouts" and ancestors[-2] == "normal" and ancestors[-3] == "layouts":
+		addIdDefinition(context, "entities", visited, visited.childId("id"))
+	# script ids (.../variables/value)
+	elif depth > 1 and ancestors[-1] == "variables":
+		addIdDefinition(context, "script variable", visited, visited.childId("id"))
+
+@checkRule(withChild=("code",), childTags=("value", "id"))
+def collectIdUsages(visited: VisitedElement, context: CheckContext) -> None:
+	codeId = visited.childId("code")
+	if codeId == ACTION_CODE_HASH:
+		category = "actions"
+	elif codeId == ENTITY_CODE_HASH:
+		category = "entities"
+	else:
+		return
+	if visited.child("value") is not None:
+		valueId = visited.childId("value")
+	elif visited.child("id") is not None:
+		valueId = visited.childId("id")
+	else:
+		return
+	if valueId == 0 or valueId == -1:
+		return
+	context.summary.idReferences.append((category, codeId, valueId, visited.path()))
+
+@checkRule(withChild=("size", "count"))
+def verifySizes(visited: VisitedElement, context: CheckContext) -> None:
+	sizeElem = visited.child("size")
+	if sizeElem is not None:
+		sizeElemI = visited.childIndex("size")
+		size = int(sizeElem.text)
+	else:
+		countElem = visited.child("count")
+		if countElem is None or not countElem.text.startswith("0x"):
+			return
+		sizeElemI = visited.childIndex("count")
+		size = int(countElem.text, 16)
+
+	trueSize = visited.childCount - sizeElemI - 1
+	if trueSize != size:
+		context.addDiagnostic(visited, "size-mismatch", f"<{visited.elem.tag}> has {trueSize} elements instead of {size}")
+
+@checkRule(withAttribute="str")
+def verifyHashes(visited: VisitedElement, context: CheckContext) -> None:
+	# mismatches are reported by the cross file checks, other files might know the right string
+	elem = visited.elem
+	hashStr = elem.get("str")
+	context.summary.hashStrings.add(hashStr)
+	hash = int(elem.text, 16)
+	if crc32(hashStr) != hash:
+		context.summary.hashMismatches.append((visited.path(), elem.text, hash, hashStr))
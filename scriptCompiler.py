@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+from threading import Lock
+from typing import List
+
+import MrubyDecompiler
+from MrubyDecompiler import compileFile
+
+# compiled scripts that are kept per folder
+MAX_CACHED_SCRIPTS = 1000
+
+compilerVersion: str = None
+
+def getCompilerDirs() -> List[str]:
+    # the package folder, or the folder of compileFile if the package has no file
+    packageFile = getattr(MrubyDecompiler, "__file__", None)
+    if packageFile is not None:
+        return [os.path.dirname(os.path.abspath(packageFile))]
+    packageDirs = list(getattr(MrubyDecompiler, "__path__", []))
+    if packageDirs:
+        return packageDirs
+    return [os.path.dirname(os.path.abspath(compileFile.__code__.co_filename))]
+
+def getCompilerVersion() -> str:
+    """Hash of the files of the compiler package, changes whenever the compiler is updated"""
+    global compilerVersion
+    if compilerVersion is not None:
+        return compilerVersion
+    hasher = hashlib.blake2b(digest_size=8)
+    for compilerDir in getCompilerDirs():
+        for root, dirs, filenames in os.walk(compilerDir):
+            dirs[:] = sorted(dir for dir in dirs if dir != "__pycache__" and not dir.startswith("."))
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(root, filename))
+                hasher.update(f"{os.path.relpath(os.path.join(root, filename), compilerDir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    compilerVersion = hasher.hexdigest()
+    return compilerVersion
+
+def compileToBytes(file: str) -> bytes:
+    """Compiles a ruby script and returns the mrb, can run in a worker process"""
+    # compiled outside of the watched folder, only the final mrb is written there
+    fd, tmpPath = tempfile.mkstemp(suffix=".mrb")
+    os.close(fd)
+    try:
+        compileFile(file, tmpPath)
+        with open(tmpPath, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmpPath)
+
+def getScriptCachePath(watchDir: str) -> str:
+    # next to the watched folder, like the build cache
+    return os.path.normpath(os.path.abspath(watchDir)) + ".scriptCache"
+
+class ScriptCache:
+    """
+    Compiled mrb files by the hash of their source and the compiler version,
+    so that scripts that are changed back or built again don't have to be compiled again.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+
+    def getEntryPath(self, sourceHash: str) -> str:
+        return os.path.join(self.path, f"{sourceHash}_{getCompilerVersion()}.mrb")
+
+    def get(self, sourceHash: str) -> bytes:
+        # None if it has never been compiled
+        try:
+            with open(self.getEntryPath(sourceHash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, sourceHash: str, data: bytes) -> None:
+        entryPath = self.getEntryPath(sourceHash)
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmpPath = entryPath + ".tmp"
+            with open(tmpPath, "wb") as f:
+                f.write(data)
+            os.replace(tmpPath, entryPath)
+
+    def prune(self) -> None:
+        # removes the least recently compiled scripts
+        with self.lock:
+            if not os.path.isdir(self.path):
+                return
+            entries = [entry for entry in os.scandir(self.path) if entry.name.endswith(".mrb")]
+            if len(entries) <= MAX_CACHED_SCRIPTS:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+            for entry in entries[:len(entries) - MAX_CACHED_SCRIPTS]:
+                os.remove(entry.path)
@@ -0,0 +1,50 @@
+# Frozen copy of the original hash map generator, the reference for the output of datHashGenerator.
+# Only the writers are inlined, so that it doesn't change with ioUtils.
+import os
+import struct
+import zlib
+
+def crc32(text: str) -> int:
+    return zlib.crc32(text.encode('ascii')) & 0xFFFFFFFF
+
+def next_power_of_2_bits(x: int) -> int:
+    return 1 if x == 0 else (x - 1).bit_length()
+
+def writeLegacyHashData(files, file):
+    preHashShift = min(31, 32 - next_power_of_2_bits(len(files)))
+    bucketOffsetsSize = 1 << (31 - preHashShift)
+    bucketOffsets = [-1] * bucketOffsetsSize
+    hashes = [0] * len(files)
+    fileIndices = list(range(len(files)))
+    fileNames = [os.path.basename(i) for i in files.copy()]
+
+    # generate hashes
+    for i in range(len(files)):
+        fileName = os.path.basename(files[i])
+        hash = crc32(fileName.lower())
+        otherHash = (hash & 0x7FFFFFFF)
+        hashes[i] = otherHash
+    # sort by first half byte (x & 0x70000000)
+    # sort indices & hashes at the same time
+    hashes, fileIndices, fileNames = zip(*sorted(zip(hashes, fileIndices, fileNames), key=lambda x: x[0] & 0x70000000))
+    # generate bucket list
+    for i in range(len(files)):
+        bucketOffsetsIndex = hashes[i] >> preHashShift
+        if bucketOffsets[bucketOffsetsIndex] == -1:
+            bucketOffsets[bucketOffsetsIndex] = i
+
+    bucketsOffset = 4*4
+    hashesOffset = bucketsOffset + len(bucketOffsets)*2
+    fileIndicesOffset = hashesOffset + len(hashes)*4
+
+    file.write(struct.pack("<I", preHashShift))
+    file.write(struct.pack("<I", bucketsOffset))
+    file.write(struct.pack("<I", hashesOffset))
+    file.write(struct.pack("<I", fileIndicesOffset))
+
+    for bucketOffset in bucketOffsets:
+        file.write(struct.pack("<h", bucketOffset))
+    for hash in hashes:
+        file.write(struct.pack("<I", hash))
+    for fileIndex in fileIndices:
+        file.write(struct.pack("<h", fileIndex))
@@ -0,0 +1,74 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from nier2blender2nier.datArchive import DatArchive
+from nier2blender2nier.exportDat import export_dat, export_dat_incremental
+
+def writeFile(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def readFile(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+class DatArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        self.files = []
+        for i, extension in enumerate((".pak", ".bxm", ".mrb")):
+            path = os.path.join(self.tmpDir.name, f"file_{i}{extension}")
+            writeFile(path, bytes(range(i, i + 40)) * (i + 1))
+            self.files.append(path)
+        self.datPath = os.path.join(self.tmpDir.name, "test.dat")
+
+    def exportDat(self, incremental: bool = False):
+        # the exporters print their progress
+        with redirect_stdout(io.StringIO()):
+            if incremental:
+                export_dat_incremental(self.datPath, self.files)
+            else:
+                export_dat(self.datPath, self.files)
+
+    def testReadExportedDat(self):
+        self.exportDat()
+        with DatArchive(self.datPath) as dat:
+            self.assertEqual(dat.fileNames, [os.path.basename(file) for file in self.files])
+            self.assertEqual(dat.fileExtensions, ["pak", "bxm", "mrb"])
+            for i, file in enumerate(self.files):
+                self.assertEqual(bytes(dat.getFile(i)), readFile(file))
+
+    def testTruncatedDat(self):
+        # only the magic and a header whose tables are outside of the file
+        writeFile(self.datPath, b"DAT\x00" + struct.pack("<6i", 3, 32, 40, 60, 100, 120) + bytes(12))
+        with DatArchive(self.datPath) as dat:
+            for table in ("fileOffsets", "fileExtensions", "fileNames", "fileSizes", "hashData"):
+                with self.subTest(table=table):
+                    with self.assertRaises(ValueError):
+                        getattr(dat, table)
+
+    def testFileOutsideOfDat(self):
+        self.exportDat()
+        data = readFile(self.datPath)
+        writeFile(self.datPath, data[:-10])
+        with DatArchive(self.datPath) as dat:
+            with self.assertRaises(ValueError):
+                dat.fileSizes
+
+    def testIncrementalExportOfCorruptDat(self):
+        # a truncated or corrupt dat is replaced by a full export
+        self.exportDat()
+        expected = readFile(self.datPath)
+        for corrupt in (b"DAT\x00" + bytes(36), expected[:40], expected[:-10]):
+            with self.subTest(size=len(corrupt)):
+                writeFile(self.datPath, corrupt)
+                self.exportDat(incremental=True)
+                self.assertEqual(readFile(self.datPath), expected)
+
+if __name__ == "__main__":
+    unittest.main()
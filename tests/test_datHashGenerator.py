@@ -0,0 +1,44 @@
+import io
+import struct
+import unittest
+
+from nier2blender2nier.datHashGenerator import generateHashData
+from tests.legacyDatHashGenerator import writeLegacyHashData
+
+EXTENSIONS = (".pak", ".bin", ".bxm", ".wmb", ".wtp", ".wta", ".mot", ".sop")
+
+def makeFileNames(count: int):
+    # dat member paths with mixed case, the names are hashed lower case
+    return [f"C:/mods/p100.dat/File_{i:05d}{EXTENSIONS[i % len(EXTENSIONS)]}" for i in range(count)]
+
+def writeHashData(files) -> bytes:
+    buffer = io.BytesIO()
+    generateHashData(files).write(buffer)
+    return buffer.getvalue()
+
+def writeLegacy(files) -> bytes:
+    buffer = io.BytesIO()
+    writeLegacyHashData(files, buffer)
+    return buffer.getvalue()
+
+class DatHashGeneratorTest(unittest.TestCase):
+    def testSameBytesAsLegacyGenerator(self):
+        for count in (1, 2, 17, 1000, 5000):
+            with self.subTest(count=count):
+                files = makeFileNames(count)
+                self.assertEqual(writeHashData(files), writeLegacy(files))
+
+    def testBucketCollisions(self):
+        # names whose hashes share a bucket keep the first index of the bucket
+        files = [f"{name}.bin" for name in ("a", "b", "c", "d", "e", "f", "g", "h")] * 3
+        self.assertEqual(writeHashData(files), writeLegacy(files))
+
+    def testNoFiles(self):
+        # the legacy generator raised a ValueError for an empty dat
+        with self.assertRaises(ValueError):
+            writeLegacy([])
+        # one empty bucket, no hashes and file indices
+        self.assertEqual(writeHashData([]), struct.pack("<IIIIh", 31, 16, 18, 18, -1))
+
+if __name__ == "__main__":
+    unittest.main()
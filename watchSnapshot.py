@@ -0,0 +1,41 @@
+import json
+import os
+
+from pakRegistry import PakRegistry
+from pakWarningsChecker import WarningsChecker
+
+# has to be increased whenever the saved state changes
+SNAPSHOT_VERSION = 4
+
+def getSnapshotPath(folder: str) -> str:
+    # next to the watched folder, like the build cache
+    return os.path.normpath(os.path.abspath(folder)) + ".watchState.json"
+
+def loadSnapshot(path: str) -> dict:
+    """
+    The pakInfo registry and warnings checker state of the last run,
+    None if there is none or it is from another version.
+    Only plain json data, so that a snapshot from someone else can't run code.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        print(f"Ignoring invalid watcher state {path}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+def saveSnapshot(path: str, registry: PakRegistry, checker: WarningsChecker) -> None:
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "registry": registry.getState(),
+        "checker": checker.getState(),
+    }
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmpPath, path)